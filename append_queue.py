@@ -0,0 +1,152 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+
+class AppendQueue:
+    """Collects rows from many callers and writes them with a single append call.
+
+    A background thread waits up to max_delay seconds after the first queued row
+    (or until max_batch rows are waiting) and hands the whole batch to flush_fn.
+
+    Without a journal, each caller gets a Future that resolves to True once its
+    row is written, or False if the append failed. With a WriteJournal, rows are
+    recorded on disk first and the Future resolves to True straight away; failed
+    batches are retried in order with exponential backoff, and rows left in the
+    journal by a previous run are replayed on start.
+
+    If key is given, only rows with the same key(row) go into one batch, so a
+    batch can't half succeed across destinations and be retried whole.
+
+    If lock is given it is held while a batch is taken from the queue, written
+    by flush_fn and removed, so a caller holding the same lock sees every row
+    either still cancellable or already in the sheet, never in between. flush_fn
+    can call settle() once its rows are visible to readers elsewhere, so that
+    they stop being listed by unsynced() at that same moment.
+    """
+
+    def __init__(self, flush_fn, max_batch=50, max_delay=0.2, journal=None, lock=None, max_backoff=60, key=None):
+        self.flush_fn = flush_fn
+        self.key = key
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.journal = journal
+        self.lock = lock or threading.RLock()
+        self.max_backoff = max_backoff
+        self._pending = []  # [entry id, row, future] entries waiting for the next flush
+        self._in_flight = []  # Entries currently being written
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+
+        if journal:
+            self._pending = [[entry_id, row, None] for entry_id, row in journal.pending()]
+
+        self._thread = threading.Thread(target=self._run, name='append-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Queue a row for the next batch and return a Future for its result."""
+        future = Future()
+        with self._condition:
+            if self.journal:
+                entry_id = self.journal.append(row)
+                # The row is durable now; the sheet will catch up
+                future.set_result(True)
+                self._pending.append([entry_id, row, None])
+            else:
+                self._pending.append([next(self._ids), row, future])
+            self._condition.notify()
+        return future
+
+    def unsynced(self):
+        """Return (entry id, row) pairs accepted but not yet written to the sheet, oldest first."""
+        with self._condition:
+            return [(entry[0], entry[1]) for entry in self._in_flight + self._pending]
+
+    def settle(self):
+        """Stop listing the batch being flushed as unsynced; for flush_fn to call once it is written."""
+        with self._condition:
+            self._in_flight = []
+
+    def cancel(self, entry_ids):
+        """Drop queued rows before they are written. Returns the ids that were cancelled.
+
+        Rows already being written can't be cancelled.
+        """
+        entry_ids = set(entry_ids)
+        with self._condition:
+            cancelled = [entry for entry in self._pending if entry[0] in entry_ids]
+            self._pending = [entry for entry in self._pending if entry[0] not in entry_ids]
+        if self.journal:
+            self.journal.mark_done([entry[0] for entry in cancelled])
+        for _, _, future in cancelled:
+            if future:
+                future.set_result(False)
+        return [entry[0] for entry in cancelled]
+
+    def _run(self):
+        backoff = 1
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Give other callers a short window to join this batch
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+            if self._write():
+                backoff = 1
+            else:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def _take_batch(self):
+        """Remove and return the next batch from the pending rows. Call with _condition held."""
+        if self.key is None or not self._pending:
+            batch = self._pending[:self.max_batch]
+            self._pending = self._pending[self.max_batch:]
+            return batch
+        # The oldest row's key picks the batch; rows for other keys wait, in order, for the next one
+        first_key = self.key(self._pending[0][1])
+        batch, rest = [], []
+        for entry in self._pending:
+            if len(batch) < self.max_batch and self.key(entry[1]) == first_key:
+                batch.append(entry)
+            else:
+                rest.append(entry)
+        self._pending = rest
+        return batch
+
+    def _write(self):
+        """Take the next batch and flush it. Returns False if it should be retried."""
+        with self.lock:
+            # Rows cancelled while we waited for the lock are no longer pending
+            with self._condition:
+                batch = self._in_flight = self._take_batch()
+            if not batch:
+                return True
+            try:
+                ok = self.flush_fn([row for _, row, _ in batch])
+            except Exception as e:
+                print(f"Error flushing append queue: {e}")
+                ok = False
+
+            with self._condition:
+                self._in_flight = []
+                if not ok and self.journal:
+                    # Put the batch back in front so rows still reach the sheet in order
+                    self._pending = batch + self._pending
+                    print(f"Sheets write failed; {len(self._pending)} expense(s) kept in the journal for retry.")
+                    return False
+
+        if ok and self.journal:
+            self.journal.mark_done([entry_id for entry_id, _, _ in batch])
+        for _, _, future in batch:
+            if future:
+                future.set_result(bool(ok))
+        return True
@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+
+class AsyncSheetsManager:
+    """Awaitable facade over GoogleSheetsManager for the asyncio handlers.
+
+    Every method of the wrapped manager is exposed as a coroutine that runs the
+    blocking call on a bounded thread pool, so a slow Sheets round trip only ties
+    up a worker thread instead of the event loop.
+
+    The manager is built by factory on a worker thread when start() is called
+    (or on the first call), so authentication and spreadsheet setup don't hold
+    up the rest of startup. Calls made before it is ready wait for it. If
+    building it fails, the next start() after a backoff tries again.
+    """
+
+    def __init__(self, factory, max_workers=4):
+        self.factory = factory
+        self.manager = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sheets')
+        self.ready = None  # Future for the manager, created by start()
+        self._failures = 0  # Builds that have failed in a row
+        self._retry_at = 0  # Monotonic time before which a failed build isn't retried
+
+    def start(self):
+        """Begin building the manager in the background and return its readiness Future.
+
+        After a failed build the failed Future is returned, so callers fail fast,
+        until its backoff has passed; then the manager is built again.
+        """
+        if (self.ready is not None and self.ready.done() and self.ready.exception() is not None
+                and time.monotonic() >= self._retry_at):
+            self.ready = None
+        if self.ready is None:
+            self.ready = self.executor.submit(self._build)
+        return self.ready
+
+    def is_ready(self):
+        """True once the manager has been built successfully."""
+        return self.ready is not None and self.ready.done() and self.ready.exception() is None
+
+    def _build(self):
+        try:
+            self.manager = self.factory()
+        except Exception:
+            self._failures += 1
+            self._retry_at = time.monotonic() + min(2 ** self._failures, 60)
+            raise
+        self._failures = 0
+        return self.manager
+
+    async def wait_ready(self):
+        """Wait until the manager is built and return it; raises if building it failed."""
+        return await asyncio.wrap_future(self.start())
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            with metrics.STORAGE_CALL_SECONDS.time(name):
+                attr = getattr(await self.wait_ready(), name)
+                loop = asyncio.get_running_loop()
+                # Carry the caller's context variables over to the worker thread
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(
+                    self.executor, functools.partial(context.run, attr, *args, **kwargs)
+                )
+
+        call.__name__ = name
+        return call
+
+    async def queue_expense(self, user_id, date, amount, category, description=""):
+        """Queue an expense for the batched writer and wait for it to be written."""
+        with metrics.STORAGE_CALL_SECONDS.time('queue_expense'):
+            manager = await self.wait_ready()
+            # Submitting writes and fsyncs the journal entry (or, for backends that
+            # don't batch, writes the expense), so it runs off the event loop too
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            future = await loop.run_in_executor(
+                self.executor,
+                functools.partial(context.run, manager.queue_expense, user_id, date, amount, category, description)
+            )
+            return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
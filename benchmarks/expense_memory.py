@@ -0,0 +1,59 @@
+"""Per-row memory of expense records: the old dicts versus Expense tuples.
+
+Usage: python benchmarks/expense_memory.py [rows]
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import CATEGORIES
+from ledger import SERIAL_EPOCH, date_ordinal, expense_from_row
+
+
+def synthetic_rows(count):
+    """Expense sheet rows as the API returns them: a year of serial dates, numeric amounts."""
+    first_serial = date.today().toordinal() - SERIAL_EPOCH - 365
+    categories = list(CATEGORIES)
+    # Copy each category so every row owns its string, as a decoded API response does
+    return [[123456789, first_serial + random.randrange(365), round(random.uniform(1, 200), 2),
+             random.choice(categories).encode().decode(), f'note {i}'] for i in range(count)]
+
+
+def dict_from_row(row):
+    """The per-row dict that get_expenses returned before Expense records."""
+    return {
+        'date': date.fromordinal(date_ordinal(row[1])).isoformat(),
+        'amount': float(row[2]),
+        'category': row[3],
+        'description': row[4] if len(row) > 4 else ''
+    }
+
+
+def measure(convert, rows):
+    """Return (bytes per row, seconds) to convert every row and keep the results."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = [convert(row) for row in rows]
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return size / len(rows), elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = synthetic_rows(count)
+    print(f"{count} rows")
+    for name, convert in (('dict', dict_from_row), ('Expense', expense_from_row)):
+        per_row, elapsed = measure(convert, rows)
+        print(f"{name:>8}: {per_row:6.1f} bytes/row, {elapsed:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
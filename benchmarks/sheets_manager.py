@@ -0,0 +1,280 @@
+"""Time GoogleSheetsManager's public methods against synthetic ledgers.
+
+Each ledger size gets a fresh manager backed by the in-process fake_sheets service, so
+the numbers measure the manager's own work (caching, indexing, aggregation)
+rather than network latency. Results are written as JSON so two runs can be
+compared:
+
+    python benchmarks/sheets_manager.py --output before.json
+    python benchmarks/sheets_manager.py --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the manager alone: no quota pacing, batching delay, journal or snapshot
+os.environ.setdefault('SPREADSHEET_ID', 'benchmark')
+os.environ.setdefault('SHEETS_READS_PER_MINUTE', '0')
+os.environ.setdefault('SHEETS_WRITES_PER_MINUTE', '0')
+os.environ.setdefault('APPEND_BATCH_WINDOW', '0')
+os.environ.setdefault('WRITE_JOURNAL_PATH', '')
+os.environ.setdefault('SNAPSHOT_PATH', '')
+
+from constants import CATEGORIES
+from google_sheets import EXPENSE_HEADERS, GoogleSheetsManager
+from ledger import SERIAL_EPOCH
+from fake_sheets import FakeService
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+DEFAULT_SIZES = '1000,100000,1000000'
+HISTORY_DAYS = 730
+
+
+class BenchmarkManager(GoogleSheetsManager):
+    """GoogleSheetsManager wired to a given fake service instead of Google's API."""
+
+    def __init__(self, service, **kwargs):
+        self._fake_service = service
+        super().__init__(**kwargs)
+
+    def _authenticate(self):
+        self.service = self._fake_service
+
+    def _new_http(self):
+        return None
+
+
+def synthetic_service(rows, users, seed=0):
+    """Build a fake spreadsheet with an Expenses tab of the given size, spread over users, days and categories."""
+    rng = random.Random(seed)
+    categories = list(CATEGORIES)
+    first_serial = date.today().toordinal() - SERIAL_EPOCH - HISTORY_DAYS
+    # Sheets are appended in date order, like a real ledger
+    serials = sorted(first_serial + rng.randrange(HISTORY_DAYS + 1) for _ in range(rows))
+    expenses = [[rng.randrange(1, users + 1), serial, round(rng.uniform(1, 200), 2), rng.choice(categories),
+                 'note' if rng.random() < 0.3 else ''] for serial in serials]
+
+    service = FakeService()
+    service.spreadsheet.add_tab('Expenses', EXPENSE_HEADERS + expenses)
+    service.spreadsheet.add_tab('Budgets', [['User ID', 'Chat ID', 'Category', 'Amount']])
+    # DailyTotals is left out so the manager rebuilds it at startup, as on a first deploy
+    return service
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def measure(call, iterations, setup=None):
+    """Run call iterations times (setup, if any, untimed before each) and return its statistics."""
+    latencies = []
+    for _ in range(iterations):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        call(*args)
+        latencies.append(time.perf_counter() - start)
+
+    # One more run under tracemalloc for the peak memory the call allocates
+    args = setup() if setup else ()
+    tracemalloc.start()
+    call(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'iterations': iterations,
+        'throughput_per_s': round(iterations / total, 2) if total else None,
+        'latency_ms': {
+            'mean': round(total / iterations * 1000, 4),
+            'p50': round(percentile(latencies, 50) * 1000, 4),
+            'p90': round(percentile(latencies, 90) * 1000, 4),
+            'p99': round(percentile(latencies, 99) * 1000, 4),
+            'max': round(latencies[-1] * 1000, 4),
+        },
+        'peak_memory_bytes': peak,
+    }
+
+
+def operations(manager, users, iterations, rng):
+    """Return (name, call, setup, iterations) for each benchmarked method."""
+    today = datetime.now().date()
+    heavy = max(1, iterations // 50)
+
+    def user():
+        return (rng.randrange(1, users + 1),)
+
+    def user_and_range():
+        return rng.randrange(1, users + 1), today - timedelta(days=30), today
+
+    def stale_user_and_range():
+        # Past its max age, so the read only fetches the rows added since
+        for ledger in manager.ledgers.values():
+            ledger.expire()
+        return user_and_range()
+
+    def latest():
+        expense = manager.get_latest_expense(rng.randrange(1, users + 1))
+        return expense.row_index, expense.sheet
+
+    def user_with_expense_today():
+        user_id = rng.randrange(1, users + 1)
+        manager.add_expense(user_id, today.isoformat(), 5, 'food')
+        return user_id, None
+
+    def new_expense():
+        return rng.randrange(1, users + 1), today.isoformat(), round(rng.uniform(1, 200), 2), rng.choice(list(CATEGORIES))
+
+    def new_budget():
+        return rng.randrange(1, users + 1), rng.choice(list(CATEGORIES)), round(rng.uniform(50, 500), 2)
+
+    def new_chat():
+        user_id = rng.randrange(1, users + 1)
+        return user_id, user_id + 1000000
+
+    def drain(*args):
+        for _ in manager.iter_expenses(*args):
+            pass
+
+    snapshot_dir = tempfile.mkdtemp()
+
+    def snapshot_path():
+        manager.snapshot_path = os.path.join(snapshot_dir, 'snapshot.pickle')
+        return ()
+
+    return [
+        ('get_expenses', manager.get_expenses, user_and_range, iterations),
+        ('get_expenses (stale cache)', manager.get_expenses, stale_user_and_range, iterations),
+        ('refresh_cache', manager.refresh_cache, None, heavy),
+        ('get_daily_summary', manager.get_daily_summary, user, iterations),
+        ('get_weekly_summary', manager.get_weekly_summary, user, iterations),
+        ('get_monthly_summary', manager.get_monthly_summary, user, iterations),
+        ('get_last_month_summary', manager.get_last_month_summary, user, iterations),
+        ('get_yearly_summary', manager.get_yearly_summary, user, iterations),
+        ('get_all_time_summary', manager.get_all_time_summary, user, iterations),
+        ('get_period_summaries', manager.get_period_summaries, user, iterations),
+        ('get_budgets', manager.get_budgets, user, iterations),
+        ('get_all_users_with_chat_id', manager.get_all_users_with_chat_id, None, iterations),
+        ('get_latest_expense', manager.get_latest_expense, user, iterations),
+        ('iter_expenses', drain, user, heavy),
+        ('add_expense', manager.add_expense, new_expense, iterations),
+        ('set_budget', manager.set_budget, new_budget, iterations),
+        ('save_user_chat_id', manager.save_user_chat_id, new_chat, iterations),
+        ('delete_row', manager.delete_row, latest, iterations),
+        ('delete_expenses_today', manager.delete_expenses_today, user_with_expense_today, iterations),
+        ('compact_expenses', manager.compact_expenses, None, heavy),
+        ('rebuild_daily_totals', manager.rebuild_daily_totals, None, heavy),
+        ('save_snapshot', manager.save_snapshot, snapshot_path, heavy),
+    ]
+
+
+def run_size(rows, users, iterations, seed):
+    """Benchmark every operation against a ledger of the given size; returns result dicts."""
+    service = synthetic_service(rows, users, seed)
+    results = []
+
+    start = time.perf_counter()
+    manager = BenchmarkManager(service)
+    # The first read loads the ledger into the cache
+    manager.get_expenses(1, date.today(), date.today())
+    startup = time.perf_counter() - start
+    results.append({'operation': 'startup (incl. DailyTotals rebuild and first load)', 'iterations': 1,
+                    'throughput_per_s': round(1 / startup, 4),
+                    'latency_ms': {key: round(startup * 1000, 4) for key in ('mean', 'p50', 'p90', 'p99', 'max')},
+                    'peak_memory_bytes': None})
+
+    rng = random.Random(seed)
+    for name, call, setup, count in operations(manager, users, iterations, rng):
+        result = measure(call, count, setup)
+        result['operation'] = name
+        results.append(result)
+        print(f"  {name:<52} p50 {result['latency_ms']['p50']:>10.3f} ms  p99 {result['latency_ms']['p99']:>10.3f} ms",
+              file=sys.stderr)
+
+    for result in results:
+        result.update({'rows': rows, 'users': users})
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    """Print each operation's p50 and peak memory relative to a previous run's file."""
+    with open(baseline_path) as f:
+        baseline = {(result['rows'], result['operation']): result for result in json.load(f)['results']}
+    print(f"{'rows':>8}  {'operation':<52} {'p50 ms (before -> after)':>30}  change")
+    for result in results:
+        before = baseline.get((result['rows'], result['operation']))
+        if not before:
+            continue
+        old, new = before['latency_ms']['p50'], result['latency_ms']['p50']
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{result['rows']:>8}  {result['operation']:<52} {old:>13.3f} -> {new:<13.3f}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f'comma-separated ledger row counts (default {DEFAULT_SIZES})')
+    parser.add_argument('--users', type=int, help='users per ledger (default: one per 200 rows, at least 10)')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per operation; heavy ones get 1/50th (default 200)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='a previous results file to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for rows in (int(size) for size in args.sizes.split(',')):
+        users = args.users or max(10, rows // 200)
+        print(f"{rows} rows, {users} users", file=sys.stderr)
+        # The manager logs every call; keep the report readable
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results.extend(run_size(rows, users, args.iterations, args.seed))
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'seed': args.seed,
+            # Kilobytes on Linux, bytes on macOS
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,33 @@
 import os
 import logging
 from datetime import datetime, timedelta, time
+from time import monotonic
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     filters, ContextTypes, ConversationHandler
 )
-from google_sheets import GoogleSheetsManager
+from storage import create_store
+from async_sheets import AsyncSheetsManager
+from quota import bulk_priority
+import metrics
+from metrics import timed_handler
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import random
+import tempfile
+import hmac
+import math
+import functools
+import diagnostics
 from constants import CATEGORIES  # Import CATEGORIES from constants.py
 from aiohttp import web
 import asyncio
+import signal
+
+# Process start, for the startup phase timings
+STARTED_AT = monotonic()
 
 # Load environment variables
 load_dotenv()
@@ -25,8 +39,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Google Sheets manager
-sheets_manager = GoogleSheetsManager()
+# Handlers await this facade so blocking Sheets calls run on a worker pool, not the event loop.
+# The storage backend (Google Sheets unless STORAGE_BACKEND says otherwise) is built in the
+# background once the bot starts, and handlers wait for it to be ready.
+sheets = AsyncSheetsManager(create_store, max_workers=int(os.getenv('SHEETS_WORKERS', 4)))
+
+# Telegram user IDs allowed to run maintenance commands such as /rebuild_totals
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Bearer token for the /admin web routes; they are disabled while it is unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
 
 # Store chat IDs for scheduled messages (optional, as we are now saving to Sheets)
 # In a production environment, rely on the data from your persistent storage (Google Sheets)
@@ -100,15 +122,16 @@ AMOUNT, CATEGORY, DESCRIPTION = range(3)
 BUDGET_CATEGORY, BUDGET_AMOUNT = range(2)
 RESET_CATEGORY = 0
 
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     # Save user's chat ID
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     print(f"[start] User ID: {user_id}, Chat ID: {chat_id}")
-    sheets_manager.save_user_chat_id(user_id, chat_id)
+    await sheets.save_user_chat_id(user_id, chat_id)
 
-    print("[start] Calling sheets_manager.save_user_chat_id")
+    print("[start] Calling sheets.save_user_chat_id")
 
     welcome_message = (
         "👋 Welcome to your Expense Tracker Bot!\n\n"
@@ -123,6 +146,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/summary - Get daily expense summary\n"
         "/reset_today - Reset today's expenses\n"
         "/undo - Undo your latest expense\n"
+        "/export - Download all your expenses as a CSV file\n"
         "/help - Show this help message\n\n"
         "Available categories:\n"
     )
@@ -131,6 +155,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(welcome_message, parse_mode=ParseMode.HTML)
 
+@timed_handler
 async def add_expense_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the add expense conversation."""
     await update.message.reply_text(
@@ -138,6 +163,7 @@ async def add_expense_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return AMOUNT
 
+@timed_handler
 async def add_expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the amount and description input and ask for category."""
     try:
@@ -166,6 +192,7 @@ async def add_expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return AMOUNT
 
+@timed_handler
 async def add_expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the category selection and save the expense."""
     query = update.callback_query
@@ -189,7 +216,11 @@ async def add_expense_category(update: Update, context: ContextTypes.DEFAULT_TYP
     # Add expense to Google Sheets using the category key
     user_id = update.effective_user.id
     date = datetime.now().strftime("%Y-%m-%d")
-    sheets_manager.add_expense(user_id, date, amount, category, description)
+    # The write is batched with other users' expenses; wait for it without blocking the event loop
+    saved = await sheets.queue_expense(user_id, date, amount, category, description)
+    if not saved:
+        await query.edit_message_text("❌ Error: Could not save your expense. Please try again.")
+        return ConversationHandler.END
     
     await query.edit_message_text(
         f"✅ Expense added successfully!\n"
@@ -227,19 +258,21 @@ async def check_budgets(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_message("❌ Error: Could not determine category.")
         return
     
-    # Get all summaries at the start
-    today_summary = sheets_manager.get_daily_summary(user_id)
-    weekly_summary = sheets_manager.get_weekly_summary(user_id)
-    monthly_summary = sheets_manager.get_monthly_summary(user_id)
+    # Get every summary window and budget in a single pass
+    period_summaries = await sheets.get_period_summaries(user_id)
+    today_summary = period_summaries.get('today', {})
+    weekly_summary = period_summaries.get('this_week', {})
+    monthly_summary = period_summaries.get('this_month', {})
+    budgets = period_summaries.get('budgets', {})
     
     # Debug logging for summaries
     print(f"Today's summary: {today_summary}")
     
     # Get budget using the category key
-    category_budget = sheets_manager.get_budget(user_id, category)
-    daily_budget = sheets_manager.get_budget(user_id, 'daily_total')
-    weekly_budget = sheets_manager.get_budget(user_id, 'weekly_total')
-    monthly_budget = sheets_manager.get_budget(user_id, 'monthly_total')
+    category_budget = budgets.get(category)
+    daily_budget = budgets.get('daily_total')
+    weekly_budget = budgets.get('weekly_total')
+    monthly_budget = budgets.get('monthly_total')
     
     # Debug logging
     print(f"Category budget for {category}: {category_budget}")
@@ -332,7 +365,7 @@ async def check_budgets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check monthly budget
     if monthly_budget is not None:
-        total_spent_month = sum(monthly_summary.get("this_month", {}).values())
+        total_spent_month = sum(monthly_summary.values())
         remaining_monthly_budget = monthly_budget - total_spent_month
         
         if remaining_monthly_budget < 0:
@@ -350,6 +383,7 @@ async def check_budgets(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             await send_message(verse_message, parse_mode=ParseMode.HTML)
 
+@timed_handler
 async def view_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """View expenses with filtering options."""
     user_id = update.effective_user.id
@@ -370,6 +404,7 @@ async def view_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+@timed_handler
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Parses the CallbackQuery and updates the message text."""
     query = update.callback_query
@@ -381,31 +416,31 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     title = ""
 
     if data == "summary_daily":
-        summary = sheets_manager.get_daily_summary(user_id)
+        summary = await sheets.get_daily_summary(user_id)
         title = "Daily Expense Summary"
     elif data == "summary_weekly":
-        summary = sheets_manager.get_weekly_summary(user_id)
+        summary = await sheets.get_weekly_summary(user_id)
         today = datetime.now().date()
         start_of_week = today - timedelta(days=today.weekday())
         title = f"Weekly Expense Summary (Week of {start_of_week.strftime('%Y-%m-%d')})"
     elif data == "summary_monthly":
-        summary = sheets_manager.get_monthly_summary(user_id)
+        summary = await sheets.get_monthly_summary(user_id)
         today = datetime.now().date()
         month_name = today.strftime('%B %Y')
         title = f"Monthly Expense Summary ({month_name})"
     elif data == "summary_last_month":
-        summary = sheets_manager.get_last_month_summary(user_id)
+        summary = await sheets.get_last_month_summary(user_id)
         today = datetime.now().date()
         first_day_of_this_month = today.replace(day=1)
         last_day_of_last_month = first_day_of_this_month - timedelta(days=1)
         last_month_name = last_day_of_last_month.strftime('%B %Y')
         title = f"Last Month Expense Summary ({last_month_name})"
     elif data == "summary_yearly":
-        summary = sheets_manager.get_yearly_summary(user_id)
+        summary = await sheets.get_yearly_summary(user_id)
         year = datetime.now().year
         title = f"Yearly Expense Summary ({year})"
     elif data == "summary_all_time":
-        summary = sheets_manager.get_all_time_summary(user_id)
+        summary = await sheets.get_all_time_summary(user_id)
         title = "All-Time Expense Summary"
 
     if not summary:
@@ -414,14 +449,17 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     message = f" {title}:\n\n"
 
+    # Get all of the user's budgets in one call
+    budgets = await sheets.get_budgets(user_id)
+
     # Get relevant budget
     budget = None
     if data == "summary_daily":
-        budget = sheets_manager.get_budget(user_id, 'daily_total')
+        budget = budgets.get('daily_total')
     elif data == "summary_weekly":
-        budget = sheets_manager.get_budget(user_id, 'weekly_total')
+        budget = budgets.get('weekly_total')
     elif data == "summary_monthly":
-        budget = sheets_manager.get_budget(user_id, 'monthly_total')
+        budget = budgets.get('monthly_total')
 
     if data == "summary_monthly":
         # Handle detailed monthly summary
@@ -434,7 +472,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 message += f"Total: ${total_monthly:.2f} / ${budget:.2f} ({percentage:.1f}%) {status}\n\n"
             
             for category, amount in summary["this_month"].items():
-                category_budget = sheets_manager.get_budget(user_id, category)
+                category_budget = budgets.get(category)
                 if category_budget:
                     percentage = (amount / category_budget) * 100
                     status = "✅" if percentage <= 100 else "⚠️"
@@ -453,7 +491,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 message += f"Total: ${total_31_days:.2f} / ${budget:.2f} ({percentage:.1f}%) {status}\n\n"
             
             for category, amount in summary["last_31_days"].items():
-                category_budget = sheets_manager.get_budget(user_id, category)
+                category_budget = budgets.get(category)
                 if category_budget:
                     percentage = (amount / category_budget) * 100
                     status = "✅" if percentage <= 100 else "⚠️"
@@ -472,7 +510,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             message += f"Total: ${total:.2f} / ${budget:.2f} ({percentage:.1f}%) {status}\n\n"
         
         for category, amount in summary.items():
-            category_budget = sheets_manager.get_budget(user_id, category)
+            category_budget = budgets.get(category)
             if category_budget:
                 percentage = (amount / category_budget) * 100
                 status = "✅" if percentage <= 100 else "⚠️"
@@ -482,6 +520,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     await query.edit_message_text(message)
 
+@timed_handler
 async def set_budget_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the set budget conversation."""
     # Create keyboard for categories
@@ -496,6 +535,7 @@ async def set_budget_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return BUDGET_CATEGORY
 
+@timed_handler
 async def set_budget_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the category selection and ask for amount."""
     query = update.callback_query
@@ -510,6 +550,7 @@ async def set_budget_category(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     return BUDGET_AMOUNT
 
+@timed_handler
 async def set_budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the amount and save the budget."""
     try:
@@ -529,7 +570,7 @@ async def set_budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
         
         # Set the budget using the category key
-        sheets_manager.set_budget(user_id, category, amount)
+        await sheets.set_budget(user_id, category, amount)
         await update.message.reply_text(
             f"✅ Budget set for {selected_category_value}: ${amount:.2f}"
         )
@@ -540,6 +581,7 @@ async def set_budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return BUDGET_AMOUNT
 
+@timed_handler
 async def set_daily_budget_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the set daily budget conversation."""
     context.user_data['budget_type'] = 'daily_total'
@@ -548,6 +590,7 @@ async def set_daily_budget_start(update: Update, context: ContextTypes.DEFAULT_T
     )
     return BUDGET_AMOUNT
 
+@timed_handler
 async def set_weekly_budget_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the set weekly budget conversation."""
     context.user_data['budget_type'] = 'weekly_total'
@@ -556,6 +599,7 @@ async def set_weekly_budget_start(update: Update, context: ContextTypes.DEFAULT_
     )
     return BUDGET_AMOUNT
 
+@timed_handler
 async def set_monthly_budget_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the set monthly budget conversation."""
     context.user_data['budget_type'] = 'monthly_total'
@@ -564,6 +608,7 @@ async def set_monthly_budget_start(update: Update, context: ContextTypes.DEFAULT
     )
     return BUDGET_AMOUNT
 
+@timed_handler
 async def set_total_budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the amount for total budgets (daily/weekly/monthly)."""
     try:
@@ -576,7 +621,7 @@ async def set_total_budget_amount(update: Update, context: ContextTypes.DEFAULT_
             return ConversationHandler.END
         
         # Set the budget
-        sheets_manager.set_budget(user_id, budget_type, amount)
+        await sheets.set_budget(user_id, budget_type, amount)
         
         # Send confirmation message
         budget_name = {
@@ -599,6 +644,7 @@ async def set_total_budget_amount(update: Update, context: ContextTypes.DEFAULT_
         )
         return BUDGET_AMOUNT
 
+@timed_handler
 async def reset_today_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the reset today conversation."""
     # Create keyboard for categories
@@ -615,6 +661,7 @@ async def reset_today_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return RESET_CATEGORY
 
+@timed_handler
 async def reset_today_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the category selection and reset expenses."""
     query = update.callback_query
@@ -624,26 +671,28 @@ async def reset_today_category(update: Update, context: ContextTypes.DEFAULT_TYP
     category = query.data.replace("reset_", "")
     
     if category == "all":
-        if sheets_manager.delete_expenses_today(user_id):
+        if await sheets.delete_expenses_today(user_id):
             await query.edit_message_text("✅ Reset all of today's expenses.")
         else:
             await query.edit_message_text("No expenses found today to reset.")
     else:
-        if sheets_manager.delete_expenses_today(user_id, category):
+        if await sheets.delete_expenses_today(user_id, category):
             await query.edit_message_text(f"✅ Reset today's expenses for category '{category}'.")
         else:
             await query.edit_message_text(f"No expenses found for category '{category}' today to reset.")
     
     return ConversationHandler.END
 
+@timed_handler
 async def get_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Get daily expense summary and budget status."""
     user_id = update.effective_user.id
-    daily_summary = sheets_manager.get_daily_summary(user_id)
+    daily_summary = await sheets.get_daily_summary(user_id)
 
     message = "📊 Daily Summary:\n\n"
 
-    daily_budget = sheets_manager.get_budget(user_id, 'daily_total')
+    budgets = await sheets.get_budgets(user_id)
+    daily_budget = budgets.get('daily_total')
     if daily_budget is not None:
         total_spent_today = sum(daily_summary.values())
         remaining_budget = daily_budget - total_spent_today
@@ -661,7 +710,7 @@ async def get_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         message += "Breakdown by Category:\n"
         for category, amount in daily_summary.items():
-            budget = sheets_manager.get_budget(user_id, category)
+            budget = budgets.get(category)
             if budget:
                 percentage = (amount / budget) * 100
                 status = "✅" if percentage <= budget else "⚠️"
@@ -671,20 +720,21 @@ async def get_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(message)
 
+@timed_handler
 async def undo_last_expense(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Undoes the user's latest expense entry."""
     user_id = update.effective_user.id
 
-    latest_expense = sheets_manager.get_latest_expense(user_id)
+    latest_expense = await sheets.get_latest_expense(user_id)
 
     if latest_expense:
-        row_index = latest_expense['row_index']
-        if sheets_manager.delete_row(row_index):
+        # Pass what was read so a row that moved in the meantime isn't deleted instead
+        if await sheets.delete_row(latest_expense.row_index, latest_expense.sheet, user_id, latest_expense):
             message = (
                 f"✅ Successfully undid your latest expense:\n"
-                f"Amount: ${latest_expense['amount']:.2f}\n"
-                f"Category: {CATEGORIES.get(latest_expense['category'], latest_expense['category']).capitalize()}"
-                + (f"\nDescription: {latest_expense['description']}" if latest_expense.get('description') else '')
+                f"Amount: ${latest_expense.amount:.2f}\n"
+                f"Category: {CATEGORIES.get(latest_expense.category, latest_expense.category).capitalize()}"
+                + (f"\nDescription: {latest_expense.description}" if latest_expense.description else '')
             )
             await update.message.reply_text(message)
         else:
@@ -692,20 +742,71 @@ async def undo_last_expense(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text("🤷‍♀️ No recent expense found to undo.")
 
+@timed_handler
+async def export_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends the user's full expense history as a CSV file."""
+    user_id = update.effective_user.id
+    await update.message.reply_text("📤 Preparing your export...")
+
+    # Rows are streamed into a temporary file rather than built up in memory
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        with bulk_priority():
+            count = await sheets.export_expenses_csv(user_id, path)
+        if count is None:
+            await update.message.reply_text("❌ Failed to export your expenses. Please try again.")
+        elif count == 0:
+            await update.message.reply_text("🤷‍♀️ You have no expenses to export yet.")
+        else:
+            with open(path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=f"expenses_{datetime.now().date().isoformat()}.csv",
+                    caption=f"✅ {count} expenses exported."
+                )
+    finally:
+        os.remove(path)
+
+@timed_handler
+async def rebuild_totals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Regenerates the daily totals rollup from the expense sheets (admins only)."""
+    if str(update.effective_user.id) not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ This command is only available to the bot's admins.")
+        return
+
+    await update.message.reply_text("🔄 Rebuilding daily totals...")
+    with bulk_priority():
+        rebuilt = await sheets.rebuild_daily_totals()
+    if rebuilt:
+        await update.message.reply_text("✅ Daily totals rebuilt from your expenses.")
+    else:
+        await update.message.reply_text("❌ Failed to rebuild daily totals. Please try again.")
+
 async def send_daily_summary_job(context: ContextTypes.DEFAULT_TYPE):
     """Sends the daily summary and encouragement to all users with a recorded chat ID and expenses/budget."""
-    users_data = sheets_manager.get_all_users_with_chat_id()
+    # Sheets calls from this job yield quota to interactive commands
+    with bulk_priority(), metrics.JOB_SECONDS.time('daily_summary'):
+        sent = await send_daily_summaries(context)
+    metrics.DAILY_SUMMARY_USERS.set(sent)
+
+async def send_daily_summaries(context: ContextTypes.DEFAULT_TYPE):
+    """Sends each user's daily summary and returns how many were sent; run by send_daily_summary_job."""
+    users_data = await sheets.get_all_users_with_chat_id()
 
     if not users_data:
         logger.info("No users with saved chat IDs found for daily summary.")
-        return
+        return 0
+
+    sent = 0
 
     for user_data in users_data:
         user_id = user_data['user_id']
         chat_id = user_data['chat_id']
         try:
-            daily_summary = sheets_manager.get_daily_summary(user_id)
-            daily_budget = sheets_manager.get_budget(user_id, 'daily_total')
+            daily_summary = await sheets.get_daily_summary(user_id)
+            budgets = await sheets.get_budgets(user_id)
+            daily_budget = budgets.get('daily_total')
 
             # Only send summary if there are expenses today or a daily budget is set
             if not daily_summary and daily_budget is None:
@@ -728,7 +829,7 @@ async def send_daily_summary_job(context: ContextTypes.DEFAULT_TYPE):
             if daily_summary:
                 message += "Breakdown by Category:\n"
                 for category, amount in daily_summary.items():
-                    budget = sheets_manager.get_budget(user_id, category)
+                    budget = budgets.get(category)
                     if budget:
                          # Adjusting percentage comparison to be against budget amount, not percentage
                         percentage = (amount / budget) * 100
@@ -753,18 +854,100 @@ async def send_daily_summary_job(context: ContextTypes.DEFAULT_TYPE):
             # Send the message to the user's chat ID
             await context.bot.send_message(chat_id=chat_id, text=message)
             logger.info(f"Sent daily summary to user_id {user_id}")
+            sent += 1
 
         except Exception as e:
+             metrics.DAILY_SUMMARY_ERRORS.inc()
              logger.error(f"Error sending daily summary for user {user_id} (chat_id: {chat_id}): {e}")
 
+    return sent
+
+async def compact_expenses_job(context: ContextTypes.DEFAULT_TYPE):
+    """Removes soft-deleted expense rows from the sheet while the bot is quiet."""
+    with bulk_priority(), metrics.JOB_SECONDS.time('compact_expenses'):
+        compacted = await sheets.compact_expenses()
+    if compacted:
+        logger.info("Expense compaction finished.")
+    else:
+        logger.error("Expense compaction failed; will retry at the next scheduled run.")
+
+async def save_snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    """Periodically saves the cached ledger so a crash still allows a warm restart."""
+    with metrics.JOB_SECONDS.time('save_snapshot'):
+        await sheets.save_snapshot()
+
 # Create web application
 app = web.Application()
 
 async def health_check(request):
-    """Handle health check requests."""
+    """Handle health check requests; 503 while storage isn't ready, so the platform restarts a bot that can't reach it."""
+    # Health checks come regularly, so they also retry a failed storage startup once its backoff has passed
+    sheets.start()
+    if not sheets.is_ready():
+        return web.Response(text="Storage is not ready.", status=503)
     return web.Response(text="Bot is running!")
 
+async def metrics_endpoint(request):
+    """Serve the bot's metrics in the Prometheus text format."""
+    return web.Response(text=metrics.render(), content_type='text/plain')
+
+def admin_route(handler):
+    """Require 'Authorization: Bearer <ADMIN_TOKEN>' on a web route."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if not ADMIN_TOKEN:
+            raise web.HTTPNotFound()
+        header = request.headers.get('Authorization', '')
+        # A bare token without the scheme is rejected too
+        if not header.startswith('Bearer '):
+            raise web.HTTPUnauthorized()
+        if not hmac.compare_digest(header[len('Bearer '):].encode(), ADMIN_TOKEN.encode()):
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+    return wrapper
+
+def query_number(request, name, default, parse, maximum):
+    """Read a positive number from the query string, capped at maximum; anything else is a 400."""
+    value = request.query.get(name)
+    if value is None:
+        return default
+    try:
+        number = parse(value)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number) or number <= 0:
+        raise web.HTTPBadRequest(text=f"{name} must be a positive {'whole ' if parse is int else ''}number.")
+    return min(number, maximum)
+
+@admin_route
+async def admin_profile(request):
+    """Profile the event loop for ?seconds= (default 10, at most 60) and return the top functions."""
+    seconds = query_number(request, 'seconds', 10, float, 60)
+    report = await diagnostics.profile_event_loop(seconds, query_number(request, 'limit', 30, int, 500))
+    if report is None:
+        raise web.HTTPConflict(text="A profile is already running.")
+    return web.Response(text=report)
+
+@admin_route
+async def admin_memory(request):
+    """Report tracemalloc's top allocators and the storage caches' sizes; ?stop=1 stops tracing."""
+    if request.query.get('stop'):
+        diagnostics.stop_memory_tracing()
+        return web.json_response({'tracing': 'stopped'})
+    report = diagnostics.memory_report(query_number(request, 'limit', 20, int, 500))
+    report['caches'] = await sheets.cache_stats() if sheets.is_ready() else {}
+    return web.json_response(report)
+
+@admin_route
+async def admin_slow_handlers(request):
+    """List the slowest recent handler invocations with the Sheets calls each made."""
+    return web.json_response(metrics.RECENT_HANDLERS.slowest(query_number(request, 'limit', 20, int, 500)))
+
 app.router.add_get('/health', health_check)
+app.router.add_get('/metrics', metrics_endpoint)
+app.router.add_get('/admin/profile', admin_profile)
+app.router.add_get('/admin/memory', admin_memory)
+app.router.add_get('/admin/slow', admin_slow_handlers)
 
 async def start_web_server():
     """Start the web server."""
@@ -840,6 +1023,8 @@ def main():
     application.add_handler(CommandHandler("view", view_expenses))
     application.add_handler(CommandHandler("undo", undo_last_expense))
     application.add_handler(CommandHandler("summary", get_summary))
+    application.add_handler(CommandHandler("export", export_expenses))
+    application.add_handler(CommandHandler("rebuild_totals", rebuild_totals))
     application.add_handler(CommandHandler("help", start))
     application.add_handler(CommandHandler("start", start))
 
@@ -853,19 +1038,50 @@ def main():
     )
     logger.info("Daily summary job scheduled for 23:59.")
 
+    # Deletes only tombstone rows; compact them away in bulk during quiet hours
+    compaction_hour = int(os.getenv('COMPACTION_HOUR', 4))
+    application.job_queue.run_daily(
+        compact_expenses_job,
+        time=time(hour=compaction_hour, minute=0),
+    )
+    logger.info(f"Expense compaction job scheduled for {compaction_hour:02d}:00.")
+
+    snapshot_interval = int(os.getenv('SNAPSHOT_INTERVAL', 600))
+    application.job_queue.run_repeating(save_snapshot_job, interval=snapshot_interval, first=snapshot_interval)
+
+    async def report_storage_ready():
+        """Logs when the storage backend finishes initializing in the background."""
+        try:
+            await sheets.wait_ready()
+            logger.info("Storage ready %.2fs after start", monotonic() - STARTED_AT)
+        except Exception as e:
+            logger.error(f"Storage initialization failed: {e}")
+
     # Start both the bot and web server
     async def start_services():
+        # Authenticate and set up the spreadsheet on a worker thread while everything else starts
+        sheets.start()
+        storage_ready_task = asyncio.create_task(report_storage_ready())
+
         # Start web server
         runner = web.AppRunner(app)
         await runner.setup()
         site = web.TCPSite(runner, '0.0.0.0', int(os.getenv('PORT', 8080)))
         await site.start()
-        logger.info("Web server started on port %s", os.getenv('PORT', 8080))
+        logger.info("Web server started on port %s %.2fs after start", os.getenv('PORT', 8080), monotonic() - STARTED_AT)
 
         # Start bot
         await application.initialize()
         await application.start()
         await application.updater.start_polling()
+        logger.info("Polling for updates %.2fs after start", monotonic() - STARTED_AT)
+
+        # Hosts such as Render stop the bot with SIGTERM; cancel this task so the cleanup below
+        # (including the ledger snapshot) runs instead of the process dying mid-way
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:  # Not available on Windows
+            pass
 
         try:
             # Keep the application running
@@ -883,6 +1099,11 @@ def main():
             await application.shutdown()
             logger.info("Cleaning up web server...")
             await runner.cleanup()
+            storage_ready_task.cancel()
+            if sheets.is_ready():
+                logger.info("Saving ledger snapshot...")
+                await sheets.save_snapshot()
+            sheets.shutdown()
             logger.info("Shutdown complete")
 
     # Run the application
@@ -0,0 +1,71 @@
+from constants import CATEGORIES, CATEGORY_KEYS
+from ledger import date_ordinal
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; callers fall back to plain Python loops
+    np = None
+
+
+def available():
+    """True if NumPy is installed and columnar aggregation can be used."""
+    return np is not None
+
+
+class ExpenseColumns:
+    """Expense rows stored as parallel NumPy arrays for vectorized group-bys.
+
+    Categories are small integer codes: the keys of constants.CATEGORIES come
+    first (display values map to the same code), and any other category text
+    gets the next free code.
+    """
+
+    def __init__(self, user_ids, dates, amounts, codes, categories):
+        self.user_ids = user_ids  # int64 user ids
+        self.dates = dates  # int32 date ordinals
+        self.amounts = amounts  # float64 amounts
+        self.codes = codes  # uint16 category codes, indexing self.categories
+        self.categories = categories  # code -> category key
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Encode expense sheet rows (user id, serial date, amount, category, ...).
+
+        Raises TypeError or ValueError if a row's user id, date or amount can't be encoded.
+        """
+        categories = list(CATEGORIES)
+        category_codes = {key: code for code, key in enumerate(categories)}
+        category_codes.update({display: category_codes[key] for display, key in CATEGORY_KEYS.items()})
+
+        # Build each column with one pass and one array conversion; per-element numpy writes are far slower
+        for category in {row[3] for row in rows} - category_codes.keys():
+            category_codes[category] = len(categories)
+            categories.append(category)
+
+        return cls(
+            np.array([int(row[0]) for row in rows], dtype=np.int64),
+            np.array([date_ordinal(row[1]) for row in rows], dtype=np.int32),
+            np.array([float(row[2]) for row in rows], dtype=np.float64),
+            np.array([category_codes[row[3]] for row in rows], dtype=np.uint16),
+            categories
+        )
+
+    def daily_totals(self):
+        """Return {(user id, date ordinal, category): total} over every row."""
+        if not len(self.amounts):
+            return {}
+        # Pack (user, day, category) into one int64 so the group-by is a 1-D unique
+        users, user_index = np.unique(self.user_ids, return_inverse=True)
+        first_day = int(self.dates.min())
+        day_count = int(self.dates.max()) - first_day + 1
+        keys = (user_index.astype(np.int64) * day_count + (self.dates - first_day)) * len(self.categories) + self.codes
+        groups, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.amounts, minlength=len(groups))
+
+        group_users, rest = np.divmod(groups, day_count * len(self.categories))
+        group_days, group_codes = np.divmod(rest, len(self.categories))
+        return {
+            (str(user), day, self.categories[code]): total
+            for user, day, code, total in zip(users[group_users].tolist(), (group_days + first_day).tolist(),
+                                              group_codes.tolist(), totals.tolist())
+        }
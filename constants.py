@@ -10,4 +10,7 @@ CATEGORIES = {
     'travel': '✈️ Travel',
     'gifts': '🎁 Gifts',
     'other': '📦 Other'
-} 
\ No newline at end of file
+}
+
+# Reverse lookup from a category's display value to its key
+CATEGORY_KEYS = {value: key for key, value in CATEGORIES.items()}
@@ -0,0 +1,58 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import tracemalloc
+
+# Only one profiler can be attached to the event loop thread at a time
+_profile_lock = asyncio.Lock()
+
+
+async def profile_event_loop(seconds, limit=30):
+    """Profile the event loop thread for the given number of seconds and return the top functions.
+
+    Returns None if another profile is already running. Work done on the storage
+    worker threads is not profiled; their time shows up as waits in the handlers.
+    """
+    if _profile_lock.locked():
+        return None
+    async with _profile_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def memory_report(limit=20):
+    """Return the top allocation sites by size, starting tracemalloc first if it isn't running.
+
+    Tracing only sees allocations made after it starts, so the first call mostly
+    turns it on; later calls show what has been allocated since.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        return {'tracing': 'started', 'top_allocators': []}
+
+    current, peak = tracemalloc.get_traced_memory()
+    statistics = tracemalloc.take_snapshot().statistics('lineno')
+    return {
+        'tracing': 'running',
+        'traced_bytes': current,
+        'peak_traced_bytes': peak,
+        'top_allocators': [
+            {'location': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+            for stat in statistics[:limit]
+        ],
+    }
+
+
+def stop_memory_tracing():
+    """Stop tracemalloc, which adds overhead to every allocation while it runs."""
+    tracemalloc.stop()
@@ -0,0 +1,361 @@
+"""Local stand-in for the Google Sheets API, for load and latency testing.
+
+Implements the calls GoogleSheetsManager makes: spreadsheets.get and
+spreadsheets.batchUpdate (addSheet, deleteDimension; formatting requests are
+accepted and ignored), and values.get, batchGet, update, batchUpdate, clear and
+append. Responses follow the real API's shapes, including leaving out trailing
+empty rows and cells. Of formulas, only the COUNTIF the manager keeps in each
+expense tab is evaluated; others read back as written.
+
+It runs either in-process, as a drop-in for the service object that
+googleapiclient's build() returns (FakeService), or as an HTTP server the real
+client can talk to:
+
+    python fake_sheets.py --port 8088 --latency 0.1 --error-rate 0.02 --reads-per-minute 300
+
+Both can add latency, fail a random share of calls with 429, and enforce
+per-minute read and write quotas the way the real API does.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import httplib2
+from aiohttp import web
+from googleapiclient.errors import HttpError
+
+from quota import request_kind
+
+A1_PATTERN = re.compile(r'^([A-Z]*)(\d*)$')
+COUNTIF_PATTERN = re.compile(r'^=COUNTIF\(([A-Z]+)(\d+):([A-Z]+),"([^"]*)"\)$')
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - 64
+    return number
+
+
+def parse_range(a1):
+    """Split 'Sheet!A2:F5001' into (sheet, first column, first row, last column, last row).
+
+    Columns and rows are 1-indexed; a missing bound is None (open-ended).
+    """
+    sheet, _, cells = a1.partition('!')
+    sheet = sheet.strip("'")
+    if not cells:
+        return sheet, 1, 1, None, None
+    start, _, end = cells.partition(':')
+    first_letters, first_row = A1_PATTERN.match(start).groups()
+    last_letters, last_row = A1_PATTERN.match(end or start).groups()
+    return (sheet, _column_number(first_letters) if first_letters else 1, int(first_row) if first_row else 1,
+            _column_number(last_letters) if last_letters else None, int(last_row) if last_row else None)
+
+
+class FakeSpreadsheet:
+    """One spreadsheet's tabs as lists of rows. Calls are serialized, as the real API's are per spreadsheet."""
+
+    def __init__(self):
+        self.tabs = {}  # title -> list of rows
+        self.sheet_ids = {}  # title -> sheetId
+        self._next_id = itertools.count(1)
+        self.lock = threading.RLock()
+
+    def add_tab(self, title, rows=()):
+        with self.lock:
+            self.tabs[title] = [list(row) for row in rows]
+            self.sheet_ids[title] = next(self._next_id)
+            return self.sheet_ids[title]
+
+    def read(self, a1):
+        sheet, first_column, first_row, last_column, last_row = parse_range(a1)
+        with self.lock:
+            rows = self.tabs[sheet][first_row - 1:last_row]
+            values = []
+            for row in rows:
+                # Copy each row, as decoding a JSON response would
+                cells = [self._evaluate(sheet, cell) for cell in row[first_column - 1:last_column]]
+                while cells and cells[-1] in ('', None):
+                    cells.pop()
+                values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return {'range': a1, 'values': values} if values else {'range': a1}
+
+    def _evaluate(self, sheet, cell):
+        """Return a COUNTIF formula's result, or any other cell unchanged. Call with the lock held."""
+        match = COUNTIF_PATTERN.match(cell) if isinstance(cell, str) else None
+        if not match:
+            return cell
+        letters, first_row, _, wanted = match.groups()
+        column = _column_number(letters) - 1
+        return sum(1 for row in self.tabs[sheet][int(first_row) - 1:]
+                   if len(row) > column and str(row[column]).lower() == wanted.lower())
+
+    def write(self, a1, values):
+        sheet, first_column, first_row, _, _ = parse_range(a1)
+        with self.lock:
+            rows = self.tabs[sheet]
+            for offset, new_cells in enumerate(values):
+                index = first_row - 1 + offset
+                while len(rows) <= index:
+                    rows.append([])
+                row = rows[index]
+                end = first_column - 1 + len(new_cells)
+                if len(row) < end:
+                    row.extend([''] * (end - len(row)))
+                row[first_column - 1:end] = new_cells
+        return {'updatedRange': a1, 'updatedRows': len(values)}
+
+    def clear(self, a1):
+        sheet, first_column, first_row, last_column, last_row = parse_range(a1)
+        with self.lock:
+            rows = self.tabs[sheet]
+            for row in rows[first_row - 1:last_row]:
+                for column in range(first_column - 1, min(last_column or len(row), len(row))):
+                    row[column] = ''
+            while rows and not any(cell not in ('', None) for cell in rows[-1]):
+                rows.pop()
+        return {'clearedRange': a1}
+
+    def append(self, a1, values):
+        sheet = parse_range(a1)[0]
+        with self.lock:
+            start = len(self.tabs[sheet]) + 1
+            self.write(f'{sheet}!A{start}', values)
+        end = start + len(values) - 1
+        return {'updates': {'updatedRange': f'{sheet}!A{start}:F{end}', 'updatedRows': len(values)}}
+
+    def batch_get(self, ranges):
+        return {'valueRanges': [self.read(a1) for a1 in ranges]}
+
+    def batch_write(self, data):
+        for value_range in data:
+            self.write(value_range['range'], value_range['values'])
+        return {'totalUpdatedRanges': len(data)}
+
+    def batch_update(self, requests):
+        replies = []
+        with self.lock:
+            for request in requests:
+                if 'addSheet' in request:
+                    title = request['addSheet']['properties']['title']
+                    sheet_id = self.add_tab(title)
+                    replies.append({'addSheet': {'properties': {'title': title, 'sheetId': sheet_id}}})
+                elif 'deleteDimension' in request:
+                    dimension = request['deleteDimension']['range']
+                    title = next(title for title, sheet_id in self.sheet_ids.items() if sheet_id == dimension['sheetId'])
+                    del self.tabs[title][dimension['startIndex']:dimension['endIndex']]
+                    replies.append({})
+                else:
+                    # Formatting requests don't change values
+                    replies.append({})
+        return {'replies': replies}
+
+    def metadata(self):
+        with self.lock:
+            # New tabs get a 1000-row grid, which grows as rows are written past it
+            return {'sheets': [{'properties': {'title': title, 'sheetId': sheet_id,
+                                               'gridProperties': {'rowCount': max(len(self.tabs[title]), 1000)}}}
+                               for title, sheet_id in self.sheet_ids.items()]}
+
+
+class Faults:
+    """Latency, random 429s and per-minute quotas applied to every call.
+
+    reads_per_minute and writes_per_minute of 0 mean unlimited, as with the
+    manager's own pacing settings.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, reads_per_minute=0, writes_per_minute=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limits = {'read': reads_per_minute, 'write': writes_per_minute}
+        self._recent = {'read': deque(), 'write': deque()}  # Call times within the last minute
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Read FAKE_SHEETS_LATENCY, _JITTER, _ERROR_RATE, _READS_PER_MINUTE and _WRITES_PER_MINUTE."""
+        return cls(
+            latency=float(os.getenv('FAKE_SHEETS_LATENCY', 0)),
+            jitter=float(os.getenv('FAKE_SHEETS_JITTER', 0)),
+            error_rate=float(os.getenv('FAKE_SHEETS_ERROR_RATE', 0)),
+            reads_per_minute=int(os.getenv('FAKE_SHEETS_READS_PER_MINUTE', 0)),
+            writes_per_minute=int(os.getenv('FAKE_SHEETS_WRITES_PER_MINUTE', 0)),
+        )
+
+    def delay(self):
+        """Return how long this call should take, in seconds."""
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def rejection(self, kind):
+        """Return an error message if a call of the given kind ('read' or 'write') should fail with 429, else None."""
+        if self.error_rate and random.random() < self.error_rate:
+            return 'Injected failure.'
+        limit = self.limits[kind]
+        if not limit:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent[kind]
+            while recent and recent[0] <= now - 60:
+                recent.popleft()
+            if len(recent) >= limit:
+                return f"Quota exceeded for quota metric '{kind.capitalize()} requests' (limit {limit} per minute)."
+            recent.append(now)
+        return None
+
+
+def error_body(message):
+    return {'error': {'code': 429, 'message': message, 'status': 'RESOURCE_EXHAUSTED'}}
+
+
+class FakeRequest:
+    """A prepared call; execute() runs it, like googleapiclient's HttpRequest."""
+
+    def __init__(self, method_id, run, faults):
+        self.methodId = method_id
+        self._run = run
+        self._faults = faults
+
+    def execute(self, http=None, num_retries=0):
+        time.sleep(self._faults.delay())
+        message = self._faults.rejection(request_kind(self.methodId))
+        if message:
+            response = httplib2.Response({'status': 429})
+            response.reason = 'Too Many Requests'
+            raise HttpError(response, json.dumps(error_body(message)).encode(), uri=self.methodId)
+        return self._run()
+
+
+class FakeValues:
+    def __init__(self, service):
+        self.service = service
+
+    def _request(self, method, run):
+        return FakeRequest(f'sheets.spreadsheets.values.{method}', run, self.service.faults)
+
+    def get(self, spreadsheetId=None, range=None, **kwargs):
+        return self._request('get', lambda: self.service.spreadsheet.read(range))
+
+    def batchGet(self, spreadsheetId=None, ranges=(), **kwargs):
+        return self._request('batchGet', lambda: self.service.spreadsheet.batch_get(ranges))
+
+    def update(self, spreadsheetId=None, range=None, body=None, **kwargs):
+        return self._request('update', lambda: self.service.spreadsheet.write(range, body['values']))
+
+    def batchUpdate(self, spreadsheetId=None, body=None):
+        return self._request('batchUpdate', lambda: self.service.spreadsheet.batch_write(body['data']))
+
+    def clear(self, spreadsheetId=None, range=None, body=None):
+        return self._request('clear', lambda: self.service.spreadsheet.clear(range))
+
+    def append(self, spreadsheetId=None, range=None, body=None, **kwargs):
+        return self._request('append', lambda: self.service.spreadsheet.append(range, body['values']))
+
+
+class FakeService:
+    """In-process drop-in for build('sheets', 'v4', ...), backed by a FakeSpreadsheet."""
+
+    def __init__(self, spreadsheet=None, faults=None):
+        self.spreadsheet = spreadsheet or FakeSpreadsheet()
+        self.faults = faults or Faults()
+
+    @classmethod
+    def from_env(cls):
+        return cls(faults=Faults.from_env())
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return FakeValues(self)
+
+    def get(self, spreadsheetId=None, **kwargs):
+        return FakeRequest('sheets.spreadsheets.get', self.spreadsheet.metadata, self.faults)
+
+    def batchUpdate(self, spreadsheetId=None, body=None):
+        return FakeRequest('sheets.spreadsheets.batchUpdate',
+                           lambda: self.spreadsheet.batch_update(body['requests']), self.faults)
+
+
+def make_app(faults=None):
+    """Build an aiohttp app serving the Sheets v4 REST paths, one FakeSpreadsheet per spreadsheet ID."""
+    faults = faults or Faults()
+    spreadsheets = {}
+
+    def dispatch(http_method, path, query, body):
+        """Route a request to (kind, callable) or raise HTTPNotFound."""
+        spreadsheet_id, _, rest = path.partition('/')
+        spreadsheet_id, _, action = spreadsheet_id.partition(':')
+        spreadsheet = spreadsheets.setdefault(spreadsheet_id, FakeSpreadsheet())
+
+        if not rest:
+            if http_method == 'GET' and not action:
+                return 'read', spreadsheet.metadata
+            if http_method == 'POST' and action == 'batchUpdate':
+                return 'write', lambda: spreadsheet.batch_update(body['requests'])
+        elif rest == 'values:batchGet' and http_method == 'GET':
+            return 'read', lambda: spreadsheet.batch_get(query.getall('ranges', []))
+        elif rest == 'values:batchUpdate' and http_method == 'POST':
+            return 'write', lambda: spreadsheet.batch_write(body['data'])
+        elif rest.startswith('values/'):
+            a1 = rest[len('values/'):]
+            if http_method == 'GET':
+                return 'read', lambda: spreadsheet.read(a1)
+            if http_method == 'PUT':
+                return 'write', lambda: spreadsheet.write(a1, body['values'])
+            if http_method == 'POST' and a1.endswith(':append'):
+                return 'write', lambda: spreadsheet.append(a1[:-len(':append')], body['values'])
+            if http_method == 'POST' and a1.endswith(':clear'):
+                return 'write', lambda: spreadsheet.clear(a1[:-len(':clear')])
+        raise web.HTTPNotFound()
+
+    async def handle(request):
+        body = await request.json() if request.can_read_body else {}
+        kind, run = dispatch(request.method, request.match_info['path'], request.query, body)
+        await asyncio.sleep(faults.delay())
+        message = faults.rejection(kind)
+        if message:
+            return web.json_response(error_body(message), status=429)
+        try:
+            return web.json_response(run())
+        except (KeyError, StopIteration) as e:
+            return web.json_response(
+                {'error': {'code': 400, 'message': f'Unable to parse range or sheet: {e}', 'status': 'INVALID_ARGUMENT'}},
+                status=400)
+
+    app = web.Application()
+    app['spreadsheets'] = spreadsheets
+    app.router.add_route('*', '/v4/spreadsheets/{path:.*}', handle)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local fake of the Google Sheets API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +/- seconds around --latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls (0-1) that fail with 429')
+    parser.add_argument('--reads-per-minute', type=int, default=0, help='read quota per minute; 0 is unlimited')
+    parser.add_argument('--writes-per-minute', type=int, default=0, help='write quota per minute; 0 is unlimited')
+    args = parser.parse_args()
+
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.reads_per_minute, args.writes_per_minute)
+    print(f"Fake Sheets API on http://{args.host}:{args.port}/ (point SHEETS_API_ENDPOINT at it)")
+    web.run_app(make_app(faults), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,151 @@
 import os
-from datetime import datetime, timedelta
+import re
+import functools
+from datetime import date, datetime, timedelta
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 import pickle
-from constants import CATEGORIES  # Import CATEGORIES from constants.py
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from constants import CATEGORY_KEYS
+from ledger import (BudgetTable, DailyTotalsTable, DELETED, ExpenseLedger, date_ordinal, is_deleted,
+                    expense_date_cache_size, expense_from_row, parse_start_row, to_serial)
+from append_queue import AppendQueue
+import columnar
+import metrics
+from journal import WriteJournal
+from http_pool import HttpPool
+from quota import INTERACTIVE, QuotaScheduler, priority, request_kind
+from storage import ExpenseStore, LatestExpense
 
-class GoogleSheetsManager:
-    def __init__(self):
+EXPENSES_SHEET = 'Expenses'
+EXPENSE_HEADERS = [['User ID', 'Date', 'Amount', 'Category', 'Description', 'Status']]
+# Each expense tab counts its own tombstones next to the headers, so a tail sync can tell
+# whether any were written elsewhere without reading the whole status column
+TOMBSTONE_COUNT_CELL = 'G1'
+TOMBSTONE_COUNT_FORMULA = f'=COUNTIF(F2:F,"{DELETED}")'
+# Rollup of expense amounts per user, day and category key, read by the summaries
+DAILY_TOTALS_SHEET = 'DailyTotals'
+DAILY_TOTALS_HEADERS = [['User ID', 'Date', 'Category', 'Amount']]
+# Reads return numbers as numbers and dates as serial day numbers, so rows need no string parsing
+VALUE_RENDER_OPTIONS = {'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'SERIAL_NUMBER'}
+# Bumped whenever the snapshot layout or the cached row format changes
+SNAPSHOT_VERSION = 1
+# Sheet name reported by get_latest_expense for rows still waiting in the append queue
+PENDING_SHEET = '(unsynced)'
+# Monthly expense tabs, e.g. 'Expenses_2026_10'
+PARTITION_PATTERN = re.compile(r'^Expenses_(\d{4})_(\d{2})$')
+
+def partition_name(expense_date):
+    """Return the monthly expense tab that holds rows dated expense_date."""
+    return f"{EXPENSES_SHEET}_{expense_date.year}_{expense_date.month:02d}"
+
+def synchronized(method):
+    """Run a manager method that changes the sheet under the write lock, so read-modify-write sequences don't interleave."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class GoogleSheetsManager(ExpenseStore):
+    def __init__(self, cache_max_age=None):
         self.SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
         self.SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
         self.creds = None
         self.service = None
+        # Talk to a local fake_sheets server (e.g. 'http://localhost:8088/') or, with 'memory',
+        # an in-process fake instead of Google, for load and latency testing
+        self.api_endpoint = os.getenv('SHEETS_API_ENDPOINT', '')
+
+        # Write expenses to one tab per month instead of the single Expenses tab
+        self.partitioned = os.getenv('EXPENSE_PARTITIONS', 'none').lower() == 'monthly'
+
+        # In-process copies of the expense tabs and the Budgets sheet; 0 disables them
+        if cache_max_age is None:
+            cache_max_age = float(os.getenv('LEDGER_CACHE_MAX_AGE', 300))
+        self.cache_max_age = cache_max_age
+        self.ledgers = {} # Expense tab title -> ExpenseLedger, created as tabs are read
+        self.budgets = BudgetTable(cache_max_age) if cache_max_age > 0 else None
+        self.daily_totals = DailyTotalsTable(cache_max_age) if cache_max_age > 0 else None
+
+        # Sheet title -> sheetId, filled from the spreadsheet metadata once per process
+        self.sheet_ids = {}
+        # Number of API round trips made, keyed by API method (e.g. 'sheets.spreadsheets.values.get')
+        self.api_calls = Counter()
+        self._stats_lock = threading.Lock()
+
+        # Guards the in-process caches. It is only held while they are read or updated, never
+        # across a Sheets call, so reads from fresh caches don't wait on the network
+        self._lock = threading.RLock()
+        # Serializes changes to the sheet (appends, tombstones, budget and rollup updates,
+        # compaction), each planned against the caches and then applied to them. Taken before _lock.
+        self._write_lock = threading.RLock()
+        self._writer = None # Thread holding the write lock through _writing(), if any
+        self._writes_done = 0 # Completed _writing() sections; see _write_token
+        self._snapshot_lock = threading.Lock()
+
+        # Paces calls to the Sheets per-minute quotas; interactive calls go ahead of bulk jobs
+        self.quota = QuotaScheduler(
+            reads_per_minute=int(os.getenv('SHEETS_READS_PER_MINUTE', 60)),
+            writes_per_minute=int(os.getenv('SHEETS_WRITES_PER_MINUTE', 60))
+        )
+        self.max_retries = int(os.getenv('SHEETS_MAX_RETRIES', 5))
+
+        # One HTTP client per concurrent call, since httplib2 is not thread-safe; by default
+        # enough for the handler workers plus the append queue
+        self.http_pool = HttpPool(self._new_http, size=int(os.getenv('SHEETS_POOL_SIZE', 5)))
+
+        # Rows per values().get when a full scan pages through an expense tab
+        self.chunk_rows = int(os.getenv('SHEETS_CHUNK_ROWS', 5000))
+
+        phase_start = time.monotonic()
         self._authenticate()
+        print(f"Startup: authenticated with Google Sheets in {time.monotonic() - phase_start:.2f}s")
+        phase_start = time.monotonic()
         self._initialize_sheets()
+        print(f"Startup: checked spreadsheet tabs in {time.monotonic() - phase_start:.2f}s")
+
+        # Cached expense tabs are saved locally so a restart only downloads what changed since
+        self.snapshot_path = os.getenv('SNAPSHOT_PATH', 'ledger_snapshot.pickle')
+        self._restore_snapshot()
+
+        # New expenses are journaled to local disk first, so a Sheets outage delays them instead of losing them
+        journal_path = os.getenv('WRITE_JOURNAL_PATH', 'write_journal.jsonl')
+        self.journal = WriteJournal(journal_path) if journal_path else None
+        # Rows replayed from the journal can flush straight away, and the flush refers to self.append_queue
+        with self._write_lock:
+            self.append_queue = AppendQueue(
+                self._append_expense_rows,
+                max_batch=int(os.getenv('APPEND_BATCH_SIZE', 50)),
+                max_delay=float(os.getenv('APPEND_BATCH_WINDOW', 0.2)),
+                journal=self.journal,
+                lock=self._write_lock,
+                # One expense tab per batch, so a failed append never leaves part of a batch written
+                key=lambda row: self._expense_sheet_for(row[1])
+            )
 
     def _authenticate(self):
-        """Authenticate with Google Sheets API."""
+        """Authenticate with Google Sheets API, or connect to the fake set by SHEETS_API_ENDPOINT."""
+        if self.api_endpoint == 'memory':
+            import fake_sheets
+            self.service = fake_sheets.FakeService.from_env()
+            return
+        if self.api_endpoint:
+            self.creds = AnonymousCredentials()
+            self.service = build('sheets', 'v4', credentials=self.creds,
+                                 client_options={'api_endpoint': self.api_endpoint})
+            return
+
         if os.path.exists('token.pickle'):
             with open('token.pickle', 'rb') as token:
                 self.creds = pickle.load(token)
@@ -35,23 +163,36 @@ class GoogleSheetsManager:
 
         self.service = build('sheets', 'v4', credentials=self.creds)
 
+    def _new_http(self):
+        """Create an authorized HTTP client with its own connection for the pool.
+
+        build_http() sets the same socket timeout build() would, so a hung
+        connection fails the call instead of holding the write lock forever.
+        """
+        if self.api_endpoint:
+            return build_http() # The fakes don't check credentials
+        return AuthorizedHttp(self.creds, http=build_http())
+
     def _initialize_sheets(self):
         """Initialize the spreadsheet with required sheets if they don't exist."""
         try:
             # Check if sheets exist
             print("Checking existing sheets...")
-            sheet_metadata = self.service.spreadsheets().get(spreadsheetId=self.SPREADSHEET_ID).execute()
+            sheet_metadata = self._execute(self.service.spreadsheets().get(spreadsheetId=self.SPREADSHEET_ID))
             sheets = sheet_metadata.get('sheets', [])
-            existing_sheets = [sheet['properties']['title'] for sheet in sheets]
+            self.sheet_ids = {sheet['properties']['title']: sheet['properties']['sheetId'] for sheet in sheets}
+            existing_sheets = list(self.sheet_ids)
             print(f"Existing sheets: {existing_sheets}")
 
             # Create sheets if they don't exist
-            if 'Expenses' not in existing_sheets:
-                print("Creating 'Expenses' sheet...")
-                self._create_sheet('Expenses', [
-                    ['User ID', 'Date', 'Amount', 'Category', 'Description']
-                ])
-                print("'Expenses' sheet creation requested.")
+            expenses_sheet = self._expense_sheet_for(datetime.now().date())
+            if expenses_sheet not in existing_sheets:
+                print(f"Creating '{expenses_sheet}' sheet...")
+                self._create_sheet(expenses_sheet, EXPENSE_HEADERS)
+                self._format_date_columns([expenses_sheet])
+                print(f"'{expenses_sheet}' sheet creation requested.")
+            # Tabs created before the tombstone count existed get it too
+            self._write_tombstone_counts(self._expense_sheets())
             
             if 'Budgets' not in existing_sheets:
                 print("Creating 'Budgets' sheet...")
@@ -60,6 +201,13 @@ class GoogleSheetsManager:
                 ])
                 print("'Budgets' sheet creation requested.")
 
+            if DAILY_TOTALS_SHEET not in existing_sheets:
+                print(f"Creating '{DAILY_TOTALS_SHEET}' sheet...")
+                self._create_sheet(DAILY_TOTALS_SHEET, DAILY_TOTALS_HEADERS)
+                self._format_date_columns([DAILY_TOTALS_SHEET])
+                # Existing expenses need to be rolled up before summaries can read it
+                self.rebuild_daily_totals()
+
         except Exception as e:
             print(f"Error initializing sheets: {e}")
 
@@ -75,128 +223,829 @@ class GoogleSheetsManager:
                 }
             }
             
-            self.service.spreadsheets().batchUpdate(
+            response = self._execute(self.service.spreadsheets().batchUpdate(
                 spreadsheetId=self.SPREADSHEET_ID,
                 body={'requests': [request]}
-            ).execute()
+            ))
+            properties = response.get('replies', [{}])[0].get('addSheet', {}).get('properties', {})
+            if 'sheetId' in properties:
+                self.sheet_ids[sheet_name] = properties['sheetId']
             print(f"Sheet '{sheet_name}' created successfully.")
 
             # Add headers
             range_name = f'{sheet_name}!A1'
             print(f"Adding headers to '{sheet_name}' at range {range_name}...")
-            self.service.spreadsheets().values().update(
+            self._execute(self.service.spreadsheets().values().update(
                 spreadsheetId=self.SPREADSHEET_ID,
                 range=range_name,
                 valueInputOption='RAW',
                 body={'values': headers}
-            ).execute()
+            ))
             print(f"Headers added to '{sheet_name}'.")
 
         except Exception as e:
             print(f"Error creating sheet {sheet_name}: {e}")
 
+    def _format_date_columns(self, sheet_names):
+        """Display column B (serial dates) of the given tabs as yyyy-mm-dd."""
+        requests = [{
+            'repeatCell': {
+                'range': {
+                    'sheetId': self.sheet_ids[sheet_name],
+                    'startRowIndex': 1, # Leave the header row as text
+                    'startColumnIndex': 1,
+                    'endColumnIndex': 2
+                },
+                'cell': {'userEnteredFormat': {'numberFormat': {'type': 'DATE', 'pattern': 'yyyy-mm-dd'}}},
+                'fields': 'userEnteredFormat.numberFormat'
+            }
+        } for sheet_name in sheet_names if sheet_name in self.sheet_ids]
+        if requests:
+            self._execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.SPREADSHEET_ID,
+                body={'requests': requests}
+            ))
+
+    def _write_tombstone_counts(self, sheet_names):
+        """Put the tombstone count formula next to the headers of the given expense tabs."""
+        if not sheet_names:
+            return
+        self._execute(self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.SPREADSHEET_ID,
+            body={
+                'valueInputOption': 'USER_ENTERED',
+                'data': [{'range': f'{sheet_name}!{TOMBSTONE_COUNT_CELL}', 'values': [[TOMBSTONE_COUNT_FORMULA]]}
+                         for sheet_name in sheet_names]
+            }
+        ))
+
+    @staticmethod
+    def _tombstone_count(values):
+        """Parse a read of TOMBSTONE_COUNT_CELL; None if the tab doesn't have the formula."""
+        try:
+            return int(values[0][0])
+        except (IndexError, TypeError, ValueError):
+            return None
+
+    def _execute(self, request):
+        """Execute a Sheets API request within quota, retrying with exponential backoff on 429 and 5xx.
+
+        An append that failed with a 5xx may still have been applied, and retrying it
+        would add its rows twice, so appends are only retried on 429.
+        """
+        method = getattr(request, 'methodId', 'unknown')
+        retry_server_errors = not method.endswith('.append')
+        for attempt in range(self.max_retries + 1):
+            self.quota.acquire(request_kind(method))
+            with self._stats_lock:
+                self.api_calls[method] += 1
+            with self.http_pool.borrow() as http, metrics.sheets_call(method):
+                try:
+                    return request.execute(http=http)
+                except HttpError as e:
+                    status = e.resp.status
+                    metrics.SHEETS_API_ERRORS.inc(method, status)
+                    if attempt == self.max_retries or (status != 429 and (status < 500 or not retry_server_errors)):
+                        raise
+                except Exception:
+                    metrics.SHEETS_API_ERRORS.inc(method, 'exception')
+                    raise
+            delay = min(2 ** attempt, 32) + random.random()
+            print(f"Sheets API returned {status} for {method}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _batch_get(self, ranges):
+        """Fetch several ranges in one round trip and return their values in the same order."""
+        result = self._execute(self.service.spreadsheets().values().batchGet(
+            spreadsheetId=self.SPREADSHEET_ID,
+            ranges=ranges,
+            **VALUE_RENDER_OPTIONS
+        ))
+        return [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+
+    @contextmanager
+    def _writing(self):
+        """Hold the write lock while changing the sheet and then the caches to match.
+
+        Calls made under it use the interactive lane whatever the caller's lane:
+        other writers are waiting on the lock, so holding back for the bulk reserve
+        would only make them wait longer.
+        """
+        with self._write_lock:
+            outermost = self._writer is None
+            if outermost:
+                with self._lock:
+                    self._writer = threading.get_ident()
+            try:
+                with priority(INTERACTIVE):
+                    yield
+            finally:
+                if outermost:
+                    with self._lock:
+                        self._writer = None
+                        self._writes_done += 1
+
+    def _holds_write_lock(self):
+        return self._writer == threading.get_ident()
+
+    def _write_token(self):
+        """Return the number of completed writes, or None while one is in progress. Call with _lock held.
+
+        A read made without the write lock reflects the caches' state only if the
+        token is the same, and not None, before and after it.
+        """
+        return None if self._writer else self._writes_done
+
+    def _run_after_scan(self, scan, write):
+        """Run scan() without the write lock, then write(its result) under it.
+
+        If another write landed in between, the scan may be out of date and is
+        repeated; the last attempt scans under the lock, so the job still finishes
+        on a busy bot.
+        """
+        if self._holds_write_lock():
+            return write(scan())
+        for attempt in range(2):
+            # Wait out a write in progress rather than scan past it
+            with self._write_lock, self._lock:
+                token = self._write_token()
+            scanned = scan()
+            with self._writing():
+                if self._writes_done == token:
+                    return write(scanned)
+        with self._writing():
+            return write(scan())
+
+    def _uncached_read(self, read, user_id):
+        """Return read() and the user's unsynced rows as of the same moment, for when the cache is disabled.
+
+        A batched append landing between the two would count its rows twice or not
+        at all, so the read is repeated if one did; the last time under the write lock.
+        """
+        if not self._holds_write_lock():
+            for attempt in range(2):
+                with self._lock:
+                    token = self._write_token()
+                result = read()
+                with self._lock:
+                    if token is not None and self._write_token() == token:
+                        return result, self._unsynced_rows(user_id)
+        with self._writing():
+            return read(), self._unsynced_rows(user_id)
+
+    def cache_stats(self):
+        """Return the sizes and ages of the in-process caches, for the admin memory report."""
+        def describe(cache):
+            return {
+                'rows': len(cache.rows) if cache.rows is not None else 0,
+                'age_seconds': round(time.monotonic() - cache.loaded_at, 1) if cache.loaded_at else None,
+            }
+
+        with self._lock:
+            return {
+                'ledgers': {sheet_name: describe(ledger) for sheet_name, ledger in self.ledgers.items()},
+                'budgets': describe(self.budgets) if self.budgets else None,
+                'daily_totals': describe(self.daily_totals) if self.daily_totals else None,
+                'unsynced_expenses': len(self.append_queue.unsynced()),
+                'shared_expense_dates': expense_date_cache_size(),
+            }
+
+    def get_api_call_counts(self):
+        """Return a copy of the per-method API round trip counters."""
+        with self._stats_lock:
+            return dict(self.api_calls)
+
+    def reset_api_call_counts(self):
+        with self._stats_lock:
+            self.api_calls.clear()
+
     def add_expense(self, user_id, date, amount, category, description=""):
         """Add a new expense to the spreadsheet."""
         try:
-            values = [[user_id, date, amount, category, description]]
-            range_name = 'Expenses!A:E'
-            
-            body = {
-                'values': values
-            }
+            return self.queue_expense(user_id, date, amount, category, description).result()
+        except Exception as e:
+            print(f"Error adding expense: {e}")
+            return False
+
+    def queue_expense(self, user_id, date, amount, category, description=""):
+        """Queue an expense for the next batched append and return a Future that resolves to True on success.
+
+        With the write journal enabled the Future is already resolved once the row is on local disk.
+        """
+        return self.append_queue.submit([user_id, date, amount, category, description])
+
+    def _expense_sheet_for(self, expense_date):
+        """Return the expense tab a row dated expense_date (a date, serial number or 'YYYY-MM-DD') belongs in."""
+        if not self.partitioned:
+            return EXPENSES_SHEET
+        if not isinstance(expense_date, date):
+            expense_date = date.fromordinal(date_ordinal(expense_date))
+        return partition_name(expense_date)
+
+    def _expense_sheets(self, start_date=None, end_date=None):
+        """Return the existing expense tabs that can hold rows dated start_date..end_date, oldest first."""
+        if not self.partitioned:
+            return [EXPENSES_SHEET]
+
+        # The unpartitioned tab may still hold rows from before partitioning was enabled
+        sheets = [EXPENSES_SHEET] if EXPENSES_SHEET in self.sheet_ids else []
+        for title in sorted(self.sheet_ids):
+            match = PARTITION_PATTERN.match(title)
+            if not match:
+                continue
+            first_day = date(int(match.group(1)), int(match.group(2)), 1)
+            last_day = (first_day + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+            if (start_date is None or last_day >= start_date) and (end_date is None or first_day <= end_date):
+                sheets.append(title)
+        return sheets
+
+    def _ensure_expense_sheet(self, sheet_name):
+        """Create an expense tab on first use, e.g. when a new month starts. Call under _writing()."""
+        if sheet_name in self.sheet_ids:
+            return
+        self._create_sheet(sheet_name, EXPENSE_HEADERS)
+        if sheet_name not in self.sheet_ids:
+            raise RuntimeError(f"Could not create sheet {sheet_name}")
+        self._format_date_columns([sheet_name])
+        self._write_tombstone_counts([sheet_name])
+        if self.cache_max_age > 0:
+            # A new tab holds only its headers, so there is nothing to download
+            with self._lock:
+                self._ledger(sheet_name).load(EXPENSE_HEADERS)
+
+    def _ledger(self, sheet_name):
+        return self.ledgers.setdefault(sheet_name, ExpenseLedger(self.cache_max_age))
+
+    def _append_expense_rows(self, values):
+        """Append a batch of expense rows to the spreadsheet, one request per expense tab.
+
+        The append queue batches rows by tab, so a batch from it is a single request.
+        """
+        try:
+            batches = {}
+            for row in values:
+                # Store the date as a serial number and the amount as a number, the way reads return them
+                sheet_row = [row[0], to_serial(date_ordinal(row[1])), float(row[2])] + row[3:]
+                batches.setdefault(self._expense_sheet_for(row[1]), []).append(sheet_row)
+
+            with self._writing():
+                # Load stale caches before appending; loaded afterwards, they would already hold the rows
+                self._load_stale_caches()
+                appended = [] # (expense tab, first row written, rows)
+                for sheet_name, rows in batches.items():
+                    self._ensure_expense_sheet(sheet_name)
+                    appended.append((sheet_name, self._append_to_tab(sheet_name, rows), rows))
+                totals = self._write_daily_totals(self._daily_changes(values))
+
+                # Add the rows to the caches and take them off the queue in one step, so readers count each once
+                with self._lock:
+                    for sheet_name, start_row, rows in appended:
+                        if sheet_name in self.ledgers:
+                            self.ledgers[sheet_name].append_rows(start_row, rows)
+                    self._apply_daily_totals(totals)
+                    self.append_queue.settle()
             
-            self.service.spreadsheets().values().append(
+            print(f"Appended {len(values)} expense(s).")
+            return True
+        except Exception as e:
+            print(f"Error adding expenses: {e}")
+            return False
+
+    def _append_to_tab(self, sheet_name, rows):
+        """Append rows to an expense tab and return the row number of the first. Call under _writing().
+
+        A 5xx doesn't say whether the append was applied, and _execute doesn't retry
+        it. If the tab is cached, its next rows are read back: when they are the ones
+        sent, the append went through and is not reported as failed, so the queue
+        doesn't write them a second time.
+        """
+        try:
+            result = self._execute(self.service.spreadsheets().values().append(
                 spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name,
+                range=f'{sheet_name}!A:E',
                 valueInputOption='RAW',
-                body=body
-            ).execute()
-            
+                body={'values': rows}
+            ))
+            return parse_start_row(result.get('updates', {}).get('updatedRange'))
+        except HttpError as e:
+            ledger = self.ledgers.get(sheet_name)
+            if e.resp.status < 500 or not ledger or not ledger.is_loaded():
+                raise
+            start_row = len(ledger.rows) + 1
+            written = self._batch_get([f'{sheet_name}!A{start_row}:F{start_row + len(rows) - 1}'])[0]
+            if len(written) != len(rows) or not all(
+                    self._is_expected_row(row, sent[0], expense_from_row(sent)) for row, sent in zip(written, rows)):
+                raise
+            print(f"Append to '{sheet_name}' returned {e.resp.status} but its rows were written.")
+            return start_row
+
+    def _load_stale_caches(self, expense_sheets=None):
+        """Bring the given expense tabs (default: the current one), the budgets and the totals up to date in one batchGet.
+
+        Expense tabs that are already cached only have their new rows read, plus the
+        status column of the earlier ones; the other caches are reloaded in full. The read is
+        made without holding the cache lock. If a write lands while it is in flight
+        the result is dropped and the read repeated, the last time under the write lock.
+        """
+        if expense_sheets is None:
+            expense_sheets = self._expense_sheets(datetime.now().date(), datetime.now().date())
+        if self._holds_write_lock():
+            # No other write can land in between, so whatever is read is current
+            self._sync_caches(expense_sheets, check=False)
+            return
+        for attempt in range(2):
+            if self._sync_caches(expense_sheets):
+                return
+        with self._writing():
+            self._sync_caches(expense_sheets, check=False)
+
+    def _sync_caches(self, expense_sheets, check=True):
+        """One attempt at _load_stale_caches. Returns False, having loaded nothing, if a write overlapped it.
+
+        check=False skips that test, for callers holding the write lock.
+        """
+        with self._lock:
+            stale = [] # (cache, range) pairs to reload in full
+            tails = [] # (ledger, sheet name, cached row count) to sync from their last row
+            for sheet_name in expense_sheets:
+                ledger = self._ledger(sheet_name)
+                if ledger.is_fresh():
+                    metrics.LEDGER_CACHE_LOOKUPS.inc('hit')
+                elif ledger.is_loaded() and len(ledger.rows) > 1:
+                    metrics.LEDGER_CACHE_LOOKUPS.inc('tail')
+                    tails.append((ledger, sheet_name, len(ledger.rows)))
+                else:
+                    metrics.LEDGER_CACHE_LOOKUPS.inc('full')
+                    stale.append((ledger, f'{sheet_name}!A:F'))
+            if self.budgets and not self.budgets.is_fresh():
+                stale.append((self.budgets, 'Budgets!A:D'))
+            if self.daily_totals and not self.daily_totals.is_fresh():
+                stale.append((self.daily_totals, f'{DAILY_TOTALS_SHEET}!A:D'))
+            if not stale and not tails:
+                return True
+            # A write in progress could land mid-read; the caller waits it out and tries again
+            token = self._write_token()
+            if check and token is None:
+                return False
+
+            ranges = [range_name for _, range_name in stale]
+            for ledger, sheet_name, row_count in tails:
+                # The rows from the last cached one on, and the tab's count of tombstones
+                ranges.append(f'{sheet_name}!A{row_count}:F')
+                ranges.append(f'{sheet_name}!{TOMBSTONE_COUNT_CELL}')
+
+        results = iter(self._batch_get(ranges))
+        with self._lock:
+            if check and self._write_token() != token:
+                return False
+            for cache, _ in stale:
+                values = next(results)
+                # Another reader may have loaded it meanwhile
+                if not cache.is_fresh():
+                    cache.load(values)
+
+            resync = [] # (ledger, sheet name) to reload in full
+            checks = [] # (ledger, sheet name, cached rows, cached row count, tail) with tombstones written elsewhere
+            for ledger, sheet_name, row_count in tails:
+                tail = next(results)
+                tombstones = self._tombstone_count(next(results))
+                # Another reader may have synced it meanwhile
+                if ledger.is_fresh() or not ledger.is_loaded() or len(ledger.rows) != row_count:
+                    continue
+                if not ledger.tail_matches(tail):
+                    resync.append((ledger, sheet_name))
+                elif tombstones == ledger.deleted + sum(1 for row in tail[1:] if is_deleted(row)):
+                    ledger.sync_tail(tail)
+                else:
+                    checks.append((ledger, sheet_name, ledger.rows, row_count, tail))
+
+        if checks:
+            # Find the new tombstones from the status column; the comparison runs outside the
+            # lock and only its result, the rows to mark deleted, is applied under it
+            columns = self._batch_get([f'{sheet_name}!F2:F{row_count}' for _, sheet_name, _, row_count, _ in checks])
+            changes = [ledger.status_changes(rows[:row_count], column)
+                       for (ledger, _, rows, row_count, _), column in zip(checks, columns)]
+            with self._lock:
+                if check and self._write_token() != token:
+                    return False
+                for (ledger, sheet_name, rows, _, tail), newly_deleted in zip(checks, changes):
+                    if ledger.rows is not rows or ledger.is_fresh():
+                        continue
+                    if newly_deleted is None or not ledger.sync_tail(tail, newly_deleted):
+                        resync.append((ledger, sheet_name))
+
+        for _, sheet_name in resync:
+            print(f"'{sheet_name}' changed other than by appends; resyncing it in full.")
+            metrics.LEDGER_CACHE_LOOKUPS.inc('resync')
+        resync = [(ledger, f'{sheet_name}!A:F') for ledger, sheet_name in resync]
+        if resync:
+            values = self._batch_get([range_name for _, range_name in resync])
+            with self._lock:
+                if check and self._write_token() != token:
+                    return False
+                for (cache, _), cache_values in zip(resync, values):
+                    cache.load(cache_values)
+        return True
+
+    @contextmanager
+    def _cached(self, expense_sheets=None):
+        """Bring the caches up to date, then hold the cache lock while the caller reads them.
+
+        Any Sheets calls are made before the lock is taken, so a read from fresh
+        caches never waits on the network or on a write in progress.
+        """
+        if expense_sheets is None:
+            expense_sheets = self._expense_sheets(datetime.now().date(), datetime.now().date())
+        while True:
+            self._load_stale_caches(expense_sheets)
+            with self._lock:
+                # A failed write can drop a cache again between the load and here
+                if (all(sheet_name in self.ledgers and self.ledgers[sheet_name].is_loaded() for sheet_name in expense_sheets)
+                        and self.budgets.is_loaded() and self.daily_totals.is_loaded()):
+                    yield
+                    return
+
+    @contextmanager
+    def _expense_values(self, sheets):
+        """Yield {tab: rows} for the given expense tabs; from the ledger cache, the cache lock is held meanwhile."""
+        if not sheets:
+            yield {}
+        elif self.cache_max_age > 0:
+            with self._cached(sheets):
+                yield {sheet_name: self.ledgers[sheet_name].rows for sheet_name in sheets}
+        else:
+            yield self._read_expense_tabs(sheets)
+
+    def _read_expense_tabs(self, sheets):
+        """Read the given expense tabs from the sheet as {tab: rows}."""
+        if not sheets:
+            return {}
+        return dict(zip(sheets, self._batch_get([f'{sheet_name}!A:F' for sheet_name in sheets])))
+
+    def _read_expense_chunks(self, sheets):
+        """Yield the live rows of the given expense tabs, one window of chunk_rows rows at a time.
+
+        Each window is a separate values().get, so a full scan only ever holds one
+        window of the sheet in memory. The scan is not atomic: a compaction that
+        runs part way through can shift rows between windows.
+        """
+        if not sheets:
+            return
+        # Blank rows in the middle of a tab (e.g. cleared by hand) make windows come back short,
+        # so the scan runs to the end of each tab's grid rather than to the first short window
+        row_counts = self._grid_row_counts()
+        for sheet_name in sheets:
+            last_row = row_counts.get(sheet_name)
+            start = 2 # Skip header row
+            while last_row is None or start <= last_row:
+                end = start + self.chunk_rows - 1
+                result = self._execute(self.service.spreadsheets().values().get(
+                    spreadsheetId=self.SPREADSHEET_ID,
+                    range=f'{sheet_name}!A{start}:F{end}',
+                    **VALUE_RENDER_OPTIONS
+                ))
+                values = result.get('values', [])
+                rows = [row for row in values if len(row) >= 4 and not is_deleted(row)]
+                if rows:
+                    yield rows
+                # Without the grid size, stop at the first empty window
+                if last_row is None and not values:
+                    break
+                start = end + 1
+
+    def _grid_row_counts(self):
+        """Return {tab: number of rows in its grid}, blank ones included, from the spreadsheet metadata."""
+        metadata = self._execute(self.service.spreadsheets().get(
+            spreadsheetId=self.SPREADSHEET_ID,
+            fields='sheets.properties(title,gridProperties.rowCount)'
+        ))
+        return {sheet['properties']['title']: sheet['properties']['gridProperties']['rowCount']
+                for sheet in metadata.get('sheets', []) if 'rowCount' in sheet['properties'].get('gridProperties', {})}
+
+    def iter_expenses(self, user_id, start_date=None, end_date=None):
+        """Yield a user's expenses, oldest tab first, reading the sheet in windows rather than all at once."""
+        for rows in self._read_expense_chunks(self._expense_sheets(start_date, end_date)):
+            for row in rows:
+                if str(row[0]) != str(user_id):
+                    continue
+                if start_date and end_date and not start_date.toordinal() <= date_ordinal(row[1]) <= end_date.toordinal():
+                    continue
+                yield expense_from_row(row)
+
+        # Include accepted rows that haven't reached the sheet yet
+        for _, row in self._unsynced_rows(user_id):
+            if start_date and end_date and not start_date.toordinal() <= date_ordinal(row[1]) <= end_date.toordinal():
+                continue
+            yield expense_from_row(row)
+
+    def _get_budget_table(self):
+        """Return the Budgets sheet as a BudgetTable, from the cache when it is fresh."""
+        if self.budgets:
+            self._load_stale_caches()
+            return self.budgets
+
+        result = self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=self.SPREADSHEET_ID,
+            range='Budgets!A:D',
+            **VALUE_RENDER_OPTIONS
+        ))
+        table = BudgetTable()
+        table.load(result.get('values', []))
+        return table
+
+    @contextmanager
+    def _budget_table(self):
+        """Yield the Budgets sheet as a BudgetTable for reading; a cached one is read under the cache lock."""
+        if self.budgets:
+            with self._cached():
+                yield self.budgets
+        else:
+            yield self._get_budget_table()
+
+    def _get_daily_totals(self):
+        """Return the DailyTotals sheet as a DailyTotalsTable, from the cache when it is fresh."""
+        if self.daily_totals:
+            self._load_stale_caches()
+            return self.daily_totals
+
+        result = self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=self.SPREADSHEET_ID,
+            range=f'{DAILY_TOTALS_SHEET}!A:D',
+            **VALUE_RENDER_OPTIONS
+        ))
+        table = DailyTotalsTable()
+        table.load(result.get('values', []))
+        return table
+
+    def _daily_changes(self, rows, sign=1):
+        """Sum expense rows into {(user id, date ordinal, category key): amount} changes for the rollup."""
+        changes = {}
+        for row in rows:
+            key = (str(row[0]), date_ordinal(row[1]), self._category_key(row[3]))
+            changes[key] = changes.get(key, 0) + sign * float(row[2])
+        return changes
+
+    def _write_daily_totals(self, changes):
+        """Apply {(user id, date ordinal, category key): amount} changes to the DailyTotals sheet. Call under _writing().
+
+        Returns what _apply_daily_totals needs to mirror the writes in the cache, so
+        callers can apply them in the same step as their own cache updates. A failure
+        is logged rather than raised: the expenses themselves were already written,
+        and rebuild_daily_totals repairs the rollup.
+        """
+        if not changes:
+            return None
+        try:
+            table = self._get_daily_totals()
+            updates = []
+            new_rows = []
+            with self._lock:
+                for key, change in changes.items():
+                    row_number = table.row_numbers.get(key)
+                    if row_number:
+                        updates.append((row_number, round(table.amount(row_number) + change, 2)))
+                    else:
+                        new_rows.append([key[0], to_serial(key[1]), key[2], round(change, 2)])
+
+            if updates:
+                self._execute(self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.SPREADSHEET_ID,
+                    body={
+                        'valueInputOption': 'RAW',
+                        'data': [{'range': f'{DAILY_TOTALS_SHEET}!D{row_number}', 'values': [[amount]]}
+                                 for row_number, amount in updates]
+                    }
+                ))
+
+            start_row = None
+            if new_rows:
+                result = self._execute(self.service.spreadsheets().values().append(
+                    spreadsheetId=self.SPREADSHEET_ID,
+                    range=f'{DAILY_TOTALS_SHEET}!A:D',
+                    valueInputOption='RAW',
+                    body={'values': new_rows}
+                ))
+                start_row = parse_start_row(result.get('updates', {}).get('updatedRange'))
+            return table, updates, start_row, new_rows
+        except Exception as e:
+            print(f"Error updating daily totals: {e}")
+            if self.daily_totals:
+                with self._lock:
+                    self.daily_totals.invalidate()
+            return None
+
+    def _apply_daily_totals(self, written):
+        """Mirror the writes returned by _write_daily_totals in the DailyTotals cache. Call with _lock held."""
+        if not written:
+            return
+        table, updates, start_row, new_rows = written
+        for row_number, amount in updates:
+            table.set_amount(row_number, amount)
+        if new_rows:
+            table.append_rows(start_row, new_rows)
+
+    def rebuild_daily_totals(self):
+        """Regenerate the DailyTotals rollup from the expense tabs, e.g. after it has drifted.
+
+        The tabs are scanned without the write lock (see _run_after_scan), so the
+        scan's paced reads don't hold up other writes.
+        """
+        try:
+            return self._run_after_scan(self._total_expense_tabs, self._replace_daily_totals)
+        except Exception as e:
+            print(f"Error rebuilding daily totals: {e}")
+            return False
+
+    def _total_expense_tabs(self):
+        """Total the expense tabs per user, day and category key, as DailyTotals rows."""
+        # Total each window of the expense tabs as it arrives, so only the totals outlive it
+        changes = {}
+        for expense_rows in self._read_expense_chunks(self._expense_sheets()):
+            chunk_changes = None
+            if columnar.available():
+                try:
+                    # Vectorized group-by; worthwhile once the ledger reaches hundreds of thousands of rows
+                    chunk_changes = columnar.ExpenseColumns.from_rows(expense_rows).daily_totals()
+                except (TypeError, ValueError) as e:
+                    print(f"Falling back to row-by-row rebuild: {e}")
+            if chunk_changes is None:
+                chunk_changes = self._daily_changes(expense_rows)
+            for key, amount in chunk_changes.items():
+                changes[key] = changes.get(key, 0) + amount
+        return [[user, to_serial(ordinal), category, round(amount, 2)]
+                for (user, ordinal, category), amount in sorted(changes.items())]
+
+    def _replace_daily_totals(self, rows):
+        """Overwrite the DailyTotals sheet with the given rows. Call under _writing()."""
+        self._execute(self.service.spreadsheets().values().clear(
+            spreadsheetId=self.SPREADSHEET_ID,
+            range=f'{DAILY_TOTALS_SHEET}!A2:D',
+            body={}
+        ))
+        if rows:
+            self._execute(self.service.spreadsheets().values().update(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=f'{DAILY_TOTALS_SHEET}!A2',
+                valueInputOption='RAW',
+                body={'values': rows}
+            ))
+        if self.daily_totals:
+            with self._lock:
+                self.daily_totals.load(DAILY_TOTALS_HEADERS + rows)
+
+        print(f"Rebuilt {DAILY_TOTALS_SHEET} with {len(rows)} rows.")
+        return True
+
+    def save_snapshot(self):
+        """Write the cached expense tabs to the local snapshot file so the next start can skip full downloads."""
+        if not self.snapshot_path or self.cache_max_age <= 0:
+            return False
+        try:
+            with self._lock:
+                # Copy the row lists, not the rows, so pickling runs without the cache lock
+                tabs = {sheet_name: list(ledger.rows) for sheet_name, ledger in self.ledgers.items() if ledger.is_loaded()}
+            snapshot = {
+                'version': SNAPSHOT_VERSION,
+                'spreadsheet_id': self.SPREADSHEET_ID,
+                'saved_at': time.time(),
+                # Each tab's row count is the point the next start resumes reading from
+                'tabs': tabs
+            }
+            with self._snapshot_lock:
+                temp_path = f'{self.snapshot_path}.tmp'
+                with open(temp_path, 'wb') as snapshot_file:
+                    pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+                    snapshot_file.flush()
+                    os.fsync(snapshot_file.fileno())
+                # Replace in one step so a crash mid-write never leaves a truncated snapshot
+                os.replace(temp_path, self.snapshot_path)
             return True
         except Exception as e:
-            print(f"Error adding expense: {e}")
+            print(f"Error saving snapshot: {e}")
+            return False
+
+    def _restore_snapshot(self):
+        """Warm the caches from the local snapshot, then read only the rows appended since it was saved."""
+        if not self.snapshot_path or self.cache_max_age <= 0 or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            phase_start = time.monotonic()
+            with open(self.snapshot_path, 'rb') as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+            if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('spreadsheet_id') != self.SPREADSHEET_ID:
+                print("Ignoring snapshot saved for a different spreadsheet or format.")
+                return
+
+            tabs = {sheet_name: rows for sheet_name, rows in snapshot['tabs'].items() if rows and sheet_name in self.sheet_ids}
+            with self._lock:
+                for sheet_name, rows in tabs.items():
+                    ledger = self._ledger(sheet_name)
+                    ledger.load(rows)
+                    ledger.expire()
+            # One batchGet reads the rows added since the snapshot, plus the small Budgets and DailyTotals sheets
+            self._load_stale_caches(list(tabs))
+            print(f"Startup: restored {len(tabs)} expense tab(s) from snapshot in {time.monotonic() - phase_start:.2f}s")
+        except Exception as e:
+            print(f"Error restoring snapshot: {e}")
+
+    def refresh_cache(self):
+        """Force a full resync of the ledger and budget caches from the sheet."""
+        if not self.budgets:
+            return False
+        try:
+            # As a write, so loads already in flight are dropped rather than applied over the reset
+            with self._writing():
+                with self._lock:
+                    for ledger in self.ledgers.values():
+                        ledger.invalidate()
+                    self.budgets.invalidate()
+                    self.daily_totals.invalidate()
+                self._load_stale_caches()
+            return True
+        except Exception as e:
+            print(f"Error refreshing ledger cache: {e}")
             return False
 
     def get_expenses(self, user_id, start_date=None, end_date=None):
         """Get expenses for a user within a date range."""
         try:
             print(f"get_expenses called for user {user_id} with range: {start_date} to {end_date}")
-            range_name = 'Expenses!A:E'
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            if not values:
-                return []
+            sheets = self._expense_sheets(start_date, end_date)
 
-            # Filter expenses for the user
             expenses = []
-            for row in values[1:]:  # Skip header row
-                if len(row) >= 4 and str(row[0]) == str(user_id):
-                    expense_date = datetime.strptime(row[1], '%Y-%m-%d')
-                    print(f"Checking expense on date {row[1]} (parsed as {expense_date.date()})")
-                    if start_date and end_date:
-                        if start_date <= expense_date.date() <= end_date:
-                            print("  -> Passed date filter")
-                            expenses.append({
-                                'date': row[1],
-                                'amount': float(row[2]),
-                                'category': row[3],
-                                'description': row[4] if len(row) > 4 else ''
-                            })
-                    else:
-                        print("  -> No date filter applied")
-                        expenses.append({
-                            'date': row[1],
-                            'amount': float(row[2]),
-                            'category': row[3],
-                            'description': row[4] if len(row) > 4 else ''
-                        })
+            if self.cache_max_age > 0:
+                with self._cached(sheets):
+                    for sheet_name in sheets:
+                        # Bisect the user's date-ordered rows instead of scanning the whole sheet
+                        rows = self.ledgers[sheet_name].index.lookup(user_id, start_date, end_date)
+                        expenses.extend(expense_from_row(row) for row in rows)
+                    unsynced = self._unsynced_rows(user_id)
+            else:
+                partitions, unsynced = self._uncached_read(lambda: self._read_expense_tabs(sheets), user_id)
+                for sheet_name in sheets:
+                    values = partitions[sheet_name]
+                    # Filter expenses for the user
+                    for row in values[1:]:  # Skip header row
+                        if len(row) >= 4 and str(row[0]) == str(user_id) and not is_deleted(row):
+                            if start_date and end_date:
+                                if start_date.toordinal() <= date_ordinal(row[1]) <= end_date.toordinal():
+                                    expenses.append(expense_from_row(row))
+                            else:
+                                expenses.append(expense_from_row(row))
+
+            # Include accepted rows that haven't reached the sheet yet
+            for _, row in unsynced:
+                if start_date and end_date:
+                    if not start_date.toordinal() <= date_ordinal(row[1]) <= end_date.toordinal():
+                        continue
+                expenses.append(expense_from_row(row))
 
             return expenses
         except Exception as e:
             print(f"Error getting expenses: {e}")
             return []
 
-    def _calculate_summary(self, expenses):
-        """Calculate summary of expenses by category from a list of expenses."""
-        summary = {}
-        for expense in expenses:
-            # Get the category from the expense
-            category_with_emoji = expense['category']
-            
-            # Convert to category key by removing emoji
-            category = None
-            for key, value in CATEGORIES.items():
-                if value == category_with_emoji:
-                    category = key
-                    break
-            
-            # If we couldn't find the category key, use the original category
-            if category is None:
-                category = category_with_emoji
-            
-            # Add to summary
-            if category not in summary:
-                summary[category] = 0
-            summary[category] += expense['amount']
+    def _unsynced_rows(self, user_id):
+        """Return (entry id, row) pairs for a user's expenses still waiting in the append queue."""
+        return [(entry_id, row) for entry_id, row in self.append_queue.unsynced() if str(row[0]) == str(user_id)]
+
+    @staticmethod
+    def _category_key(category):
+        """Map a category display value (with emoji) to its key, leaving keys unchanged."""
+        return CATEGORY_KEYS.get(category, category)
+
+    @contextmanager
+    def _rollup(self, user_id):
+        """Yield the DailyTotals rollup and the user's unsynced rows, which it doesn't count yet, as one pair."""
+        if self.daily_totals:
+            with self._cached():
+                yield self.daily_totals, self._unsynced_rows(user_id)
+        else:
+            yield self._uncached_read(self._get_daily_totals, user_id)
+
+    def _summarize(self, user_id, start_date=None, end_date=None):
+        """Sum a user's expenses per category key between two dates inclusive, from the DailyTotals rollup."""
+        with self._rollup(user_id) as rollup:
+            return self._summary(rollup, user_id, start_date, end_date)
+
+    def _summary(self, rollup, user_id, start_date=None, end_date=None):
+        """_summarize from a pair yielded by _rollup, so several windows can share one read."""
+        table, unsynced = rollup
+        summary = table.summarize(user_id, start_date, end_date)
+
+        # Accepted rows that haven't reached the sheet aren't in the rollup yet
+        for _, row in unsynced:
+            ordinal = date_ordinal(row[1])
+            if (start_date is None or ordinal >= start_date.toordinal()) and (end_date is None or ordinal <= end_date.toordinal()):
+                category = self._category_key(row[3])
+                summary[category] = summary.get(category, 0) + float(row[2])
         return summary
 
     def get_daily_summary(self, user_id):
         """Get summary of expenses for today."""
         try:
             today = datetime.now().date()
-            expenses = self.get_expenses(user_id)
-
-            # Filter today's expenses
-            today_expenses = [
-                exp for exp in expenses
-                if datetime.strptime(exp['date'], '%Y-%m-%d').date() == today
-            ]
-
-            return self._calculate_summary(today_expenses)
+            return self._summarize(user_id, today, today)
         except Exception as e:
             print(f"Error getting daily summary: {e}")
             return {}
@@ -206,8 +1055,7 @@ class GoogleSheetsManager:
         try:
             today = datetime.now().date()
             start_of_week = today - timedelta(days=today.weekday())
-            expenses = self.get_expenses(user_id, start_date=start_of_week, end_date=today)
-            return self._calculate_summary(expenses)
+            return self._summarize(user_id, start_of_week, today)
         except Exception as e:
             print(f"Error getting weekly summary: {e}")
             return {}
@@ -217,25 +1065,39 @@ class GoogleSheetsManager:
         try:
             today = datetime.now().date()
             start_of_month = today.replace(day=1)
-            expenses_month = self.get_expenses(user_id, start_date=start_of_month, end_date=today)
-
-            # Get expenses for the last 31 days
             start_date_last_31_days = today - timedelta(days=30)
-            expenses_last_31_days = self.get_expenses(user_id, start_date=start_date_last_31_days, end_date=today)
+            with self._rollup(user_id) as rollup:
+                return {
+                    "this_month": self._summary(rollup, user_id, start_of_month, today),
+                    "last_31_days": self._summary(rollup, user_id, start_date_last_31_days, today)
+                }
+        except Exception as e:
+            print(f"Error getting monthly summary: {e}")
+            return {}
 
-            return {
-                "this_month": self._calculate_summary(expenses_month),
-                "last_31_days": self._calculate_summary(expenses_last_31_days)
+    def get_period_summaries(self, user_id):
+        """Get today's, this week's, this month's and the last 31 days' summaries plus budgets in one pass."""
+        try:
+            today = datetime.now().date()
+            window_starts = {
+                'today': today,
+                'this_week': today - timedelta(days=today.weekday()),
+                'this_month': today.replace(day=1),
+                'last_31_days': today - timedelta(days=30),
             }
+            # One read of the rollup (and budgets), then each window is a bisect over at most 31 days
+            with self._rollup(user_id) as rollup:
+                summaries = {name: self._summary(rollup, user_id, start, today) for name, start in window_starts.items()}
+            summaries['budgets'] = self.get_budgets(user_id)
+            return summaries
         except Exception as e:
-            print(f"Error getting monthly summary: {e}")
+            print(f"Error getting period summaries: {e}")
             return {}
 
     def get_all_time_summary(self, user_id):
         """Get summary of all time expenses."""
         try:
-            expenses = self.get_expenses(user_id)
-            return self._calculate_summary(expenses)
+            return self._summarize(user_id)
         except Exception as e:
             print(f"Error getting all time summary: {e}")
             return {}
@@ -247,8 +1109,7 @@ class GoogleSheetsManager:
             first_day_of_this_month = today.replace(day=1)
             last_day_of_last_month = first_day_of_this_month - timedelta(days=1)
             first_day_of_last_month = last_day_of_last_month.replace(day=1)
-            expenses = self.get_expenses(user_id, start_date=first_day_of_last_month, end_date=last_day_of_last_month)
-            return self._calculate_summary(expenses)
+            return self._summarize(user_id, first_day_of_last_month, last_day_of_last_month)
         except Exception as e:
             print(f"Error getting last month summary: {e}")
             return {}
@@ -258,29 +1119,20 @@ class GoogleSheetsManager:
         try:
             today = datetime.now().date()
             first_day_of_year = today.replace(month=1, day=1)
-            expenses = self.get_expenses(user_id, start_date=first_day_of_year, end_date=today)
-            return self._calculate_summary(expenses)
+            return self._summarize(user_id, first_day_of_year, today)
         except Exception as e:
             print(f"Error getting yearly summary: {e}")
             return {}
 
+    @synchronized
     def set_budget(self, user_id, category, amount):
         """Set budget for a category."""
         try:
             # Check if budget already exists
             range_name = 'Budgets!A:C'
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            row_index = None
-            
-            for i, row in enumerate(values[1:], start=2):  # Skip header row
-                if len(row) >= 2 and str(row[0]) == str(user_id) and row[1] == category:
-                    row_index = i
-                    break
+            table = self._get_budget_table()
+            with self._lock:
+                row_index = table.budget_rows.get((str(user_id), category))
 
             if row_index:
                 # Update existing budget
@@ -288,23 +1140,28 @@ class GoogleSheetsManager:
                 body = {
                     'values': [[amount]]
                 }
-                self.service.spreadsheets().values().update(
+                self._execute(self.service.spreadsheets().values().update(
                     spreadsheetId=self.SPREADSHEET_ID,
                     range=range_name,
                     valueInputOption='RAW',
                     body=body
-                ).execute()
+                ))
+                with self._lock:
+                    table.set_cell(row_index, 2, amount)
             else:
                 # Add new budget
                 body = {
                     'values': [[user_id, category, amount]]
                 }
-                self.service.spreadsheets().values().append(
+                result = self._execute(self.service.spreadsheets().values().append(
                     spreadsheetId=self.SPREADSHEET_ID,
                     range=range_name,
                     valueInputOption='RAW',
                     body=body
-                ).execute()
+                ))
+                updated_range = result.get('updates', {}).get('updatedRange')
+                with self._lock:
+                    table.append_row(parse_start_row(updated_range), [str(user_id), category, amount])
 
             return True
         except Exception as e:
@@ -314,62 +1171,59 @@ class GoogleSheetsManager:
     def get_budget(self, user_id, category):
         """Get budget for a category."""
         try:
-            range_name = 'Budgets!A:C'
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            for row in values[1:]:  # Skip header row
-                if len(row) >= 3 and str(row[0]) == str(user_id) and row[1] == category:
-                    return float(row[2])
-            return None
+            with self._budget_table() as table:
+                return table.get(user_id, category)
         except Exception as e:
             print(f"Error getting budget: {e}")
             return None
 
+    def get_budgets(self, user_id):
+        """Get all of a user's budgets as a {category: amount} dict."""
+        try:
+            with self._budget_table() as table:
+                return table.for_user(user_id)
+        except Exception as e:
+            print(f"Error getting budgets: {e}")
+            return {}
+
+    @synchronized
     def save_user_chat_id(self, user_id, chat_id):
         """Save or update a user's chat ID in the Budgets sheet."""
         try:
             range_name = 'Budgets!A:D' # Adjusted range for new column
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-
-            values = result.get('values', [])
-            user_row_index = None
+            table = self._get_budget_table()
 
             # Find the row for the user ID
-            for i, row in enumerate(values[1:], start=2): # Start from row 2 to skip header
-                # Check if row has at least User ID column and it matches
-                if len(row) > 0 and str(row[0]) == str(user_id):
-                    user_row_index = i
-                    break
+            with self._lock:
+                user_row_index = table.user_rows.get(str(user_id))
 
             if user_row_index:
                 # Update chat ID in the existing row
                 # Assumes Chat ID is the second column (index 1)
                 range_to_update = f'Budgets!B{user_row_index}'
                 body = { 'values': [[str(chat_id)]] }
-                self.service.spreadsheets().values().update(
+                self._execute(self.service.spreadsheets().values().update(
                     spreadsheetId=self.SPREADSHEET_ID,
                     range=range_to_update,
                     valueInputOption='RAW',
                     body=body
-                ).execute()
+                ))
+                with self._lock:
+                    table.set_cell(user_row_index, 1, str(chat_id))
                 print(f"Updated chat ID for user {user_id}")
             else:
                 # Add a new row for the user with User ID and Chat ID
                 # Category and Amount can be empty initially
                 body = { 'values': [[str(user_id), str(chat_id), '', '']] }
-                self.service.spreadsheets().values().append(
+                result = self._execute(self.service.spreadsheets().values().append(
                     spreadsheetId=self.SPREADSHEET_ID,
                     range=range_name, # Append to the defined range
                     valueInputOption='RAW',
                     body=body
-                ).execute()
+                ))
+                updated_range = result.get('updates', {}).get('updatedRange')
+                with self._lock:
+                    table.append_row(parse_start_row(updated_range), body['values'][0])
                 print(f"Added new user {user_id} with chat ID {chat_id}")
 
             return True
@@ -380,80 +1234,84 @@ class GoogleSheetsManager:
     def get_all_users_with_chat_id(self):
         """Retrieves all user IDs and their associated Chat IDs from the Budgets sheet."""
         try:
-            range_name = 'Budgets!A:B' # Get User ID and Chat ID columns
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-
-            values = result.get('values', [])
-            if not values:
-                return []
-
             users_data = []
-            # Iterate starting from the second row to skip headers
-            for row in values[1:]:
-                 # Ensure row has at least User ID and Chat ID
-                if len(row) >= 2 and row[0] and row[1]:
-                    users_data.append({'user_id': str(row[0]), 'chat_id': str(row[1])})
+            with self._budget_table() as table:
+                values = table.rows # User ID and Chat ID are the first two columns
+                if not values:
+                    return []
+
+                # Iterate starting from the second row to skip headers
+                for row in values[1:]:
+                     # Ensure row has at least User ID and Chat ID
+                    if len(row) >= 2 and row[0] and row[1]:
+                        users_data.append({'user_id': str(row[0]), 'chat_id': str(row[1])})
 
             return users_data
         except Exception as e:
             print(f"Error getting all users with chat ID: {e}")
             return []
 
+    @synchronized
     def delete_expenses_today(self, user_id, category=None):
         """Deletes expense entries for a user for today, optionally filtered by category."""
         try:
-            range_name = 'Expenses!A:E' # Get all expense data
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name
-            ).execute()
+            today = datetime.now().date()
+            today_str = today.strftime("%Y-%m-%d")
+            today_ordinal = today.toordinal()
+            rows_to_delete = {} # Expense tab -> 1-indexed row numbers to delete
+            tombstones = []
+            deleted_rows = []
 
-            values = result.get('values', [])
-            if not values:
-                print("No expenses found to delete.")
+            def matches(row):
+                # Ensure row has enough columns, matches user ID and today's date and isn't already deleted
+                if (len(row) >= 2 and str(row[0]) == str(user_id) and not is_deleted(row)
+                        and date_ordinal(row[1]) == today_ordinal):
+                    # Check category if specified
+                    return category is None or (len(row) >= 4 and row[3].lower() == category.lower())
                 return False
 
-            today_str = datetime.now().strftime("%Y-%m-%d")
-            rows_to_delete = [] # Store 1-indexed row numbers to delete
+            candidates = {} # (expense tab, 1-indexed row number) -> row
+            with self._expense_values(self._expense_sheets(today, today)) as partitions:
+                for sheet_name, values in partitions.items():
+                    for i in range(1, len(values)): # Skip header row
+                        if matches(values[i]):
+                            # i + 1 because header is row 1
+                            candidates[(sheet_name, i + 1)] = values[i]
+            if self.cache_max_age > 0:
+                # Only rows still live in the sheet are deleted and taken off the rollup
+                candidates = {key: row for key, row in self._read_live_rows(candidates).items() if matches(row)}
 
-            # Find rows that match the criteria (user, date, category)
-            # Iterate from the last row upwards to avoid index issues during batch deletion
-            for i in range(len(values) - 1, 0, -1): # Iterate from second to last row up to the first data row (index 1)
-                row = values[i]
-                # Ensure row has enough columns and matches user ID and today's date
-                if len(row) >= 2 and str(row[0]) == str(user_id) and row[1] == today_str:
-                    # Check category if specified
-                    if category is None or (len(row) >= 4 and row[3].lower() == category.lower()):
-                        # Add the 1-indexed row number (i + 1 because header is row 1)
-                        rows_to_delete.append(i + 1)
+            for (sheet_name, row_number), row in sorted(candidates.items()):
+                rows_to_delete.setdefault(sheet_name, []).append(row_number)
+                deleted_rows.append(row)
+                # Tombstone the rows instead of removing them, so no other row changes position
+                tombstones.append({'range': f'{sheet_name}!F{row_number}', 'values': [[DELETED]]})
+
+            # Today's expenses that haven't reached the sheet yet are simply dropped from the queue
+            cancelled = self.append_queue.cancel([
+                entry_id for entry_id, row in self._unsynced_rows(user_id)
+                if row[1] == today_str and (category is None or row[3].lower() == category.lower())
+            ])
 
-            if not rows_to_delete:
+            if not tombstones and not cancelled:
                 print(f"No matching expenses found for deletion for user {user_id} today (category: {category}).")
                 return False
 
-            # Prepare batch delete request. Requests should be ordered by row index DESC.
-            # We iterated from the bottom up, so rows_to_delete is already in the correct order.
-            requests = [{
-                'deleteDimension': {
-                    'range': {
-                        'sheetId': self._get_sheet_id('Expenses'), # Need a helper to get sheetId
-                        'dimension': 'ROWS',
-                        'startIndex': row - 1, # API uses 0-indexed
-                        'endIndex': row # API end index is exclusive
-                    }
-                }
-            } for row in rows_to_delete]
+            if tombstones:
+                # Write every tombstone in one call
+                self._execute(self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.SPREADSHEET_ID,
+                    body={'valueInputOption': 'RAW', 'data': tombstones}
+                ))
 
-            # Execute the batch delete
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.SPREADSHEET_ID,
-                body={'requests': requests}
-            ).execute()
+                totals = self._write_daily_totals(self._daily_changes(deleted_rows, sign=-1))
+                with self._lock:
+                    for sheet_name, rows in rows_to_delete.items():
+                        if sheet_name in self.ledgers:
+                            self.ledgers[sheet_name].mark_deleted(rows)
+                    self._apply_daily_totals(totals)
 
-            print(f"Deleted {len(rows_to_delete)} expenses for user {user_id} for today (category: {category}).")
+            print(f"Deleted {len(tombstones) + len(cancelled)} expenses for user {user_id} for today (category: {category}).")
             return True
 
         except Exception as e:
@@ -462,44 +1320,39 @@ class GoogleSheetsManager:
 
     def _get_sheet_id(self, sheet_name):
         """Helper to get the sheet ID from the sheet name."""
+        if sheet_name in self.sheet_ids:
+            return self.sheet_ids[sheet_name]
         try:
-            sheet_metadata = self.service.spreadsheets().get(spreadsheetId=self.SPREADSHEET_ID).execute()
+            # Only reached if the sheet was created outside this process
+            sheet_metadata = self._execute(self.service.spreadsheets().get(spreadsheetId=self.SPREADSHEET_ID))
             sheets = sheet_metadata.get('sheets', [])
-            for sheet in sheets:
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-            return None # Sheet not found
+            self.sheet_ids = {sheet['properties']['title']: sheet['properties']['sheetId'] for sheet in sheets}
+            return self.sheet_ids.get(sheet_name) # None if the sheet is not found
         except Exception as e:
             print(f"Error getting sheet ID: {e}")
             return None
 
     def get_latest_expense(self, user_id):
-        """Gets the latest expense entry for a user along with its row index."""
+        """Gets the latest expense entry for a user along with its row index and expense tab."""
         try:
-            range_name = 'Expenses!A:E' # Get all expense data
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-
-            values = result.get('values', [])
-            if not values or len(values) <= 1: # Check if there's a header row and at least one data row
-                print("No expenses found.")
-                return None
-
-            # Iterate from the last data row upwards
-            for i in range(len(values) - 1, 0, -1): # Iterate from last row up to the first data row (index 1)
-                row = values[i]
-                # Ensure row has at least User ID and it matches
-                if len(row) > 0 and str(row[0]) == str(user_id):
-                    # Return the expense data and the 1-indexed row number
-                    return {
-                        'row_index': i + 1,
-                        'date': row[1] if len(row) > 1 else '',
-                        'amount': float(row[2]) if len(row) > 2 else 0.0,
-                        'category': row[3] if len(row) > 3 else '',
-                        'description': row[4] if len(row) > 4 else ''
-                    }
+            # An expense still waiting in the append queue is newer than anything in the sheet
+            unsynced = self._unsynced_rows(user_id)
+            if unsynced:
+                entry_id, row = unsynced[-1]
+                return LatestExpense(*expense_from_row(row), entry_id, PENDING_SHEET)
+
+            # Newest tab first, so usually only the current month is read
+            for sheet_name in reversed(self._expense_sheets()):
+                with self._expense_values([sheet_name]) as partitions:
+                    values = partitions[sheet_name]
+
+                    # Iterate from the last data row upwards
+                    for i in range(len(values) - 1, 0, -1): # Iterate from last row up to the first data row (index 1)
+                        row = values[i]
+                        # Ensure row is a complete expense, its user matches and the row isn't deleted
+                        if len(row) >= 4 and str(row[0]) == str(user_id) and not is_deleted(row):
+                            # Return the expense data and the 1-indexed row number
+                            return LatestExpense(*expense_from_row(row), i + 1, sheet_name)
 
             print(f"No expenses found for user {user_id}.")
             return None # No expense found for the user
@@ -508,31 +1361,245 @@ class GoogleSheetsManager:
             print(f"Error getting latest expense: {e}")
             return None
 
-    def delete_row(self, row_index):
-        """Deletes a specific row by its 1-indexed row number."""
+    @staticmethod
+    def _is_expected_row(row, user_id, expected):
+        """True if an expense row belongs to user_id and holds the same date, amount and category as expected.
+
+        Either check is skipped when its argument is None.
+        """
+        if user_id is not None and str(row[0]) != str(user_id):
+            return False
+        if expected is not None:
+            expense = expense_from_row(row)
+            if (expense.date != expected.date or expense.category != expected.category
+                    or abs(expense.amount - expected.amount) >= 0.005):
+                return False
+        return True
+
+    def _read_live_rows(self, rows):
+        """Read (expense tab, row number) pairs from the sheet in one batchGet; return {pair: row} for the live ones.
+
+        Deletes take their rows from here rather than the ledger cache, which can be
+        behind the sheet (e.g. restored from a snapshot taken before an /undo): only
+        a row that is still live may come off the rollup. A cached tab that disagrees
+        with the sheet is dropped, so the next read loads it again.
+        """
+        rows = list(rows)
+        if not rows:
+            return {}
+        values = self._batch_get([f'{sheet_name}!A{row_number}:F{row_number}' for sheet_name, row_number in rows])
+        live = {}
+        with self._lock:
+            for (sheet_name, row_number), row_values in zip(rows, values):
+                row = row_values[0] if row_values else []
+                row_live = len(row) >= 4 and not is_deleted(row)
+                if row_live:
+                    live[(sheet_name, row_number)] = row
+
+                ledger = self.ledgers.get(sheet_name)
+                if not ledger or not ledger.is_loaded():
+                    continue
+                cached = ledger.rows[row_number - 1] if row_number <= len(ledger.rows) else []
+                cached_live = len(cached) >= 4 and not is_deleted(cached)
+                if cached_live != row_live or (row_live and not self._is_expected_row(row, cached[0], expense_from_row(cached))):
+                    print(f"Cached '{sheet_name}' is behind the sheet at row {row_number}; reloading it.")
+                    ledger.invalidate()
+        return live
+
+    @synchronized
+    def delete_row(self, row_index, sheet_name=None, user_id=None, expected=None):
+        """Soft-deletes a specific row by its 1-indexed row number in an expense tab (default: Expenses).
+
+        Rows can move between get_latest_expense and this call (compaction removes
+        deleted rows), so pass the user_id and the expense that was read; the row is
+        only deleted if it still holds that user's expense.
+        """
+        sheet_name = sheet_name or EXPENSES_SHEET
+        if sheet_name == PENDING_SHEET:
+            # Not written yet, so drop it from the queue instead
+            if not any(entry_id == row_index and self._is_expected_row(row, user_id, expected)
+                       for entry_id, row in self.append_queue.unsynced()):
+                print(f"No matching unsynced expense {row_index} to delete.")
+                return False
+            return bool(self.append_queue.cancel([row_index]))
         if row_index is None or row_index <= 1: # Cannot delete header row or invalid index
             print(f"Invalid row index for deletion: {row_index}")
             return False
         try:
-            requests = [{
+            # The rollup needs the deleted row's user, date, category and amount
+            row = self._read_live_rows([(sheet_name, row_index)]).get((sheet_name, row_index))
+            if not row:
+                print(f"No expense to delete at row {row_index} of {sheet_name}.")
+                return False
+            if not self._is_expected_row(row, user_id, expected):
+                print(f"Row {row_index} of {sheet_name} no longer holds the expense to delete; leaving it.")
+                return False
+
+            # A single-cell tombstone; compact_expenses removes the row later
+            self._execute(self.service.spreadsheets().values().update(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=f'{sheet_name}!F{row_index}',
+                valueInputOption='RAW',
+                body={'values': [[DELETED]]}
+            ))
+
+            totals = self._write_daily_totals(self._daily_changes([row], sign=-1))
+            with self._lock:
+                if sheet_name in self.ledgers:
+                    self.ledgers[sheet_name].mark_deleted([row_index])
+                self._apply_daily_totals(totals)
+
+            print(f"Deleted row {row_index} of {sheet_name}.")
+            return True
+
+        except Exception as e:
+            print(f"Error deleting row {row_index}: {e}")
+            return False 
+
+    @synchronized
+    def migrate_expenses_to_partitions(self):
+        """Move rows from the single Expenses tab into monthly tabs. Run once after enabling EXPENSE_PARTITIONS."""
+        if not self.partitioned:
+            print("EXPENSE_PARTITIONS is not set to 'monthly'; nothing to migrate.")
+            return False
+        try:
+            if EXPENSES_SHEET not in self.sheet_ids:
+                return True
+            values = self._batch_get([f'{EXPENSES_SHEET}!A:F'])[0]
+
+            batches = {}
+            for row in values[1:]: # Skip header row
+                if len(row) >= 4 and not is_deleted(row):
+                    batches.setdefault(self._expense_sheet_for(row[1]), []).append(row[:5])
+
+            for sheet_name, rows in sorted(batches.items()):
+                self._ensure_expense_sheet(sheet_name)
+                self._execute(self.service.spreadsheets().values().append(
+                    spreadsheetId=self.SPREADSHEET_ID,
+                    range=f'{sheet_name}!A:E',
+                    valueInputOption='RAW',
+                    body={'values': rows}
+                ))
+                print(f"Moved {len(rows)} expenses to '{sheet_name}'.")
+
+            # Keep the header so the old tab stays readable, but drop the moved rows
+            self._execute(self.service.spreadsheets().values().clear(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=f'{EXPENSES_SHEET}!A2:F',
+                body={}
+            ))
+            with self._lock:
+                for ledger in self.ledgers.values():
+                    ledger.invalidate()
+            return True
+        except Exception as e:
+            print(f"Error migrating expenses to partitions: {e}")
+            return False
+
+    @synchronized
+    def migrate_to_serial_dates(self):
+        """Rewrite dates and amounts that older versions stored as text as serial numbers and numbers.
+
+        Run once after upgrading; it only rewrites tabs that still hold text values.
+        """
+        def serial(value):
+            try:
+                return to_serial(date_ordinal(value)) if isinstance(value, str) else value
+            except ValueError:
+                return value
+
+        def number(value):
+            try:
+                return float(value) if isinstance(value, str) else value
+            except ValueError:
+                return value
+
+        try:
+            sheets = self._expense_sheets() + [DAILY_TOTALS_SHEET]
+            data = []
+            for sheet_name, values in zip(sheets, self._batch_get([f'{sheet_name}!A:F' for sheet_name in sheets])):
+                rows = [row + [''] * (4 - len(row)) for row in values[1:]] # Skip header row
+                if not rows:
+                    continue
+                last_row = len(rows) + 1
+                if sheet_name == DAILY_TOTALS_SHEET:
+                    # User ID, Date, Category, Amount
+                    columns = [(f'B2:B{last_row}', [[serial(row[1])] for row in rows], [[row[1]] for row in rows]),
+                               (f'D2:D{last_row}', [[number(row[3])] for row in rows], [[row[3]] for row in rows])]
+                else:
+                    # User ID, Date, Amount, ...
+                    columns = [(f'B2:C{last_row}', [[serial(row[1]), number(row[2])] for row in rows],
+                                [row[1:3] for row in rows])]
+                data.extend({'range': f'{sheet_name}!{range_name}', 'values': converted}
+                            for range_name, converted, original in columns if converted != original)
+
+            if data:
+                self._execute(self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.SPREADSHEET_ID,
+                    body={'valueInputOption': 'RAW', 'data': data}
+                ))
+            self._format_date_columns(sheets)
+
+            with self._lock:
+                for ledger in self.ledgers.values():
+                    ledger.invalidate()
+                if self.daily_totals:
+                    self.daily_totals.invalidate()
+            print(f"Converted {len(data)} column range(s) to serial dates and numbers.")
+            return True
+        except Exception as e:
+            print(f"Error migrating to serial dates: {e}")
+            return False
+
+    def compact_expenses(self):
+        """Physically remove soft-deleted rows from every expense tab. Meant to run during quiet hours.
+
+        The tabs are read without the write lock (see _run_after_scan).
+        """
+        try:
+            sheets = self._expense_sheets()
+            return self._run_after_scan(lambda: self._read_expense_tabs(sheets), self._remove_deleted_rows)
+        except Exception as e:
+            print(f"Error compacting expenses: {e}")
+            return False
+
+    def _remove_deleted_rows(self, tabs):
+        """Delete the tombstoned rows found in {expense tab: rows} just read from the sheet. Call under _writing()."""
+        requests = []
+        compacted = {}
+        for sheet_name, values in tabs.items():
+            rows = [i + 1 for i in range(1, len(values)) if is_deleted(values[i])]
+            if not rows:
+                continue
+            compacted[sheet_name] = [row for row in values if not is_deleted(row)]
+            sheet_id = self._get_sheet_id(sheet_name)
+            # Delete from the bottom up so earlier requests don't shift later ones
+            requests.extend({
                 'deleteDimension': {
                     'range': {
-                        'sheetId': self._get_sheet_id('Expenses'), # Get sheetId for 'Expenses'
+                        'sheetId': sheet_id,
                         'dimension': 'ROWS',
-                        'startIndex': row_index - 1, # API uses 0-indexed start
-                        'endIndex': row_index # API end index is exclusive
+                        'startIndex': row - 1, # API uses 0-indexed
+                        'endIndex': row # API end index is exclusive
                     }
                 }
-            }]
-
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.SPREADSHEET_ID,
-                body={'requests': requests}
-            ).execute()
+            } for row in reversed(rows))
 
-            print(f"Deleted row {row_index}.")
+        if not requests:
+            print("No deleted expenses to compact.")
             return True
 
-        except Exception as e:
-            print(f"Error deleting row {row_index}: {e}")
-            return False 
\ No newline at end of file
+        # One batchUpdate applies every deletion atomically
+        self._execute(self.service.spreadsheets().batchUpdate(
+            spreadsheetId=self.SPREADSHEET_ID,
+            body={'requests': requests}
+        ))
+
+        # Row numbers changed, so reload the cached tabs from what was just read
+        with self._lock:
+            for sheet_name, values in compacted.items():
+                if sheet_name in self.ledgers and self.ledgers[sheet_name].is_loaded():
+                    self.ledgers[sheet_name].load(values)
+
+        print(f"Compacted {len(requests)} deleted expense row(s) from {len(compacted)} tab(s).")
+        return True
@@ -0,0 +1,48 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+
+class HttpPool:
+    """Fixed-size pool of HTTP clients for concurrent Sheets calls.
+
+    httplib2 connections are not thread-safe, so each request borrows a client of
+    its own for the duration of the call. Clients are created on first use and
+    kept, so their keep-alive connections (and TLS sessions) are reused.
+    """
+
+    def __init__(self, factory, size=5):
+        self.factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue()  # Most recently used first, while its connection is still warm
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self):
+        """Lend a client to the caller, waiting if all of them are in use."""
+        http = self._take()
+        try:
+            yield http
+        finally:
+            self._idle.put(http)
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+
+
+class WriteJournal:
+    """Append-only file of expense rows that have not been written to the sheet yet.
+
+    Each line is either {"id": n, "row": [...]} for a new write or {"done": [n, ...]}
+    once those writes reached the sheet (or were cancelled). Lines are fsynced before
+    the caller is told the write succeeded, so accepted rows survive a crash or
+    restart and are replayed on the next start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}  # entry id -> row, in write order
+        self._next_id = 1
+        self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write; everything before it is intact
+                    print(f"Skipping unreadable line in write journal {self.path}")
+                    continue
+                if 'row' in record:
+                    self._pending[record['id']] = record['row']
+                    self._next_id = max(self._next_id, record['id'] + 1)
+                for entry_id in record.get('done', []):
+                    self._pending.pop(entry_id, None)
+        if self._pending:
+            print(f"Write journal has {len(self._pending)} expense(s) waiting to be synced.")
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, row):
+        """Durably record a row and return its entry id."""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._write({'id': entry_id, 'row': row})
+            self._pending[entry_id] = row
+            return entry_id
+
+    def mark_done(self, entry_ids):
+        """Record that entries reached the sheet (or were cancelled)."""
+        with self._lock:
+            entry_ids = [entry_id for entry_id in entry_ids if entry_id in self._pending]
+            if not entry_ids:
+                return
+            for entry_id in entry_ids:
+                del self._pending[entry_id]
+            if self._pending:
+                self._write({'done': entry_ids})
+            else:
+                # Nothing left to replay, so start the file over instead of letting it grow
+                self._file.close()
+                self._file = open(self.path, 'w', encoding='utf-8')
+                os.fsync(self._file.fileno())
+
+    def pending(self):
+        """Return (entry id, row) pairs still waiting to be synced, oldest first."""
+        with self._lock:
+            return list(self._pending.items())
@@ -0,0 +1,404 @@
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from functools import lru_cache
+from storage import Expense
+
+# Expense rows carry a status in column F; deleted rows are tombstoned there until compaction
+STATUS_COLUMN = 5
+DELETED = 'deleted'
+
+
+# Sheets stores dates as serial day numbers counted from 1899-12-30
+SERIAL_EPOCH = date(1899, 12, 30).toordinal()
+
+
+def date_ordinal(value):
+    """Return the date ordinal of a sheet date cell.
+
+    Cells read with SERIAL_NUMBER rendering are numbers; rows written before dates
+    were stored as serials still hold 'YYYY-MM-DD' strings.
+    """
+    if isinstance(value, (int, float)):
+        return int(value) + SERIAL_EPOCH
+    return date.fromisoformat(value).toordinal()
+
+
+def to_serial(ordinal):
+    """Return the Sheets serial number for a date ordinal."""
+    return ordinal - SERIAL_EPOCH
+
+
+@lru_cache(maxsize=4096)
+def _date(ordinal):
+    """Return the date for an ordinal, shared by every expense on that day."""
+    return date.fromordinal(ordinal)
+
+
+def expense_date_cache_size():
+    """Return how many distinct dates expense records currently share."""
+    return _date.cache_info().currsize
+
+
+def expense_from_row(row):
+    """Build an Expense from an expense sheet row (user id, date, amount, category[, description])."""
+    # Interned categories and shared dates keep a long history down to one copy of each
+    return Expense(_date(date_ordinal(row[1])), float(row[2]), sys.intern(row[3]), row[4] if len(row) > 4 else '')
+
+
+def trimmed(row):
+    """Return a row without trailing empty cells, which the API leaves out when reading."""
+    row = list(row)
+    while row and row[-1] in ('', None):
+        row.pop()
+    return row
+
+
+def is_deleted(row):
+    """True if an expense row has been soft-deleted."""
+    return len(row) > STATUS_COLUMN and row[STATUS_COLUMN] == DELETED
+
+
+def parse_start_row(updated_range):
+    """Return the first row number of an A1 range such as 'Expenses!A12:E12'."""
+    match = re.search(r'![A-Z]+(\d+)', updated_range or '')
+    return int(match.group(1)) if match else None
+
+
+class ExpenseIndex:
+    """Per-user expense rows kept sorted by date so range queries are a bisect."""
+
+    def __init__(self):
+        self.dates = {}  # user id -> sorted list of date ordinals
+        self.rows = {}  # user id -> sheet rows, parallel to self.dates
+
+    @staticmethod
+    def _key(row):
+        """Return (user id, date ordinal) for a sheet row, or None if it can't be indexed."""
+        if len(row) < 4 or is_deleted(row):
+            return None
+        try:
+            return str(row[0]), date_ordinal(row[1])
+        except (TypeError, ValueError):
+            return None
+
+    def build(self, rows):
+        """Index every data row of the sheet (header excluded)."""
+        self.dates = {}
+        self.rows = {}
+        keyed = []
+        for position, row in enumerate(rows):
+            key = self._key(row)
+            if key:
+                keyed.append((key[0], key[1], position, row))
+        # Sort by date, then by sheet position so same-day rows keep their order
+        keyed.sort(key=lambda item: (item[1], item[2]))
+        for user, ordinal, _, row in keyed:
+            self.dates.setdefault(user, []).append(ordinal)
+            self.rows.setdefault(user, []).append(row)
+
+    def add(self, row):
+        key = self._key(row)
+        if not key:
+            return
+        user, ordinal = key
+        dates = self.dates.setdefault(user, [])
+        rows = self.rows.setdefault(user, [])
+        position = bisect_right(dates, ordinal)
+        dates.insert(position, ordinal)
+        rows.insert(position, row)
+
+    def remove(self, row):
+        key = self._key(row)
+        if not key or key[0] not in self.dates:
+            return
+        user, ordinal = key
+        dates = self.dates[user]
+        rows = self.rows[user]
+        for position in range(bisect_left(dates, ordinal), bisect_right(dates, ordinal)):
+            if rows[position] is row:
+                del dates[position]
+                del rows[position]
+                return
+
+    def lookup(self, user_id, start_date=None, end_date=None):
+        """Return a user's rows dated between start_date and end_date inclusive."""
+        user = str(user_id)
+        if user not in self.dates:
+            return []
+        dates = self.dates[user]
+        lo = bisect_left(dates, start_date.toordinal()) if start_date else 0
+        hi = bisect_right(dates, end_date.toordinal()) if end_date else len(dates)
+        return self.rows[user][lo:hi]
+
+
+class SheetCache:
+    """In-memory copy of one sheet's values with a staleness bound."""
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age  # Seconds before a resync is forced; None means never
+        self.rows = None  # Raw sheet values including the header row, so row N is rows[N - 1]
+        self.loaded_at = None
+
+    def is_loaded(self):
+        return self.rows is not None
+
+    def is_fresh(self):
+        """True if the cache is loaded and within its staleness bound."""
+        if self.rows is None or self.loaded_at is None:
+            return False
+        if self.max_age is None:
+            return True
+        return time.monotonic() - self.loaded_at < self.max_age
+
+    def load(self, values):
+        """Replace the cached contents with a full download of the sheet."""
+        self.rows = [list(row) for row in values]
+        self.loaded_at = time.monotonic()
+        self._reindex()
+
+    def expire(self):
+        """Keep the cached rows but treat them as stale, so the next read resyncs them."""
+        self.loaded_at = None
+
+    def invalidate(self):
+        """Drop the cached rows so the next read goes back to the sheet."""
+        self.rows = None
+        self.loaded_at = None
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild any lookup structures derived from self.rows."""
+
+
+class ExpenseLedger(SheetCache):
+    """In-memory copy of the Expenses sheet, kept in sync by the manager's own writes.
+
+    The sheet only grows between compactions, so a stale ledger is refreshed by
+    reading the rows from its last cached row on (sync_tail), rather than by
+    downloading the whole tab. Tombstones written elsewhere are found by
+    comparing the tab's count of them with deleted; only if they differ is the
+    status column read (status_changes).
+    """
+
+    def __init__(self, max_age=300):
+        self.index = ExpenseIndex()
+        self.deleted = 0  # Rows tombstoned in the cache
+        super().__init__(max_age)
+
+    def _reindex(self):
+        self.index = ExpenseIndex()
+        self.deleted = 0
+        if self.rows:
+            self.index.build(self.rows[1:])
+            self.deleted = sum(1 for row in self.rows[1:] if is_deleted(row))
+
+    def append_rows(self, start_row, rows):
+        """Record rows the sheet appended at start_row (1-indexed)."""
+        if self.rows is None:
+            return
+        # Someone else wrote to the sheet since we loaded it; resync on next read
+        if start_row is None or start_row != len(self.rows) + 1:
+            self.invalidate()
+            return
+        for row in rows:
+            row = list(row)
+            self.rows.append(row)
+            self.index.add(row)
+            if is_deleted(row):
+                self.deleted += 1
+
+    def tail_matches(self, tail):
+        """True if tail, the sheet's rows from the last cached row on, still starts with that row.
+
+        The last cached row moving or changing means rows were removed or rewritten.
+        """
+        return bool(tail) and trimmed(tail[0]) == trimmed(self.rows[-1])
+
+    def status_changes(self, rows, statuses):
+        """Compare the status column read from the sheet with the given cached rows.
+
+        statuses is column F from row 2 on, as read (trailing empty cells left
+        out). Returns the 1-indexed rows tombstoned since they were cached, or None
+        if any other status changed, meaning the tab was edited by hand. It only
+        reads rows, so the caller can run it without holding the manager's lock.
+        """
+        newly_deleted = []
+        for row_number in range(2, len(rows) + 1):
+            cells = statuses[row_number - 2] if row_number - 2 < len(statuses) else []
+            status = cells[0] if cells else ''
+            row = rows[row_number - 1]
+            cached_status = row[STATUS_COLUMN] if len(row) > STATUS_COLUMN else ''
+            if (status or '') == (cached_status or ''):
+                continue
+            if status != DELETED:
+                return None
+            newly_deleted.append(row_number)
+        return newly_deleted
+
+    def sync_tail(self, tail, newly_deleted=()):
+        """Apply a read of the sheet from the last cached row on, and any tombstones found by status_changes.
+
+        Returns False if a full resync is needed.
+        """
+        if not self.tail_matches(tail):
+            return False
+        self.mark_deleted(newly_deleted)
+        self.append_rows(len(self.rows) + 1, tail[1:])
+        self.loaded_at = time.monotonic()
+        return True
+
+    def mark_deleted(self, row_numbers):
+        """Mirror tombstones written to the given 1-indexed rows; the rows keep their positions."""
+        if self.rows is None:
+            return
+        for row_number in row_numbers:
+            if not 1 < row_number <= len(self.rows):
+                self.invalidate()
+                return
+            row = self.rows[row_number - 1]
+            if is_deleted(row):
+                continue
+            self.index.remove(row)
+            while len(row) <= STATUS_COLUMN:
+                row.append('')
+            row[STATUS_COLUMN] = DELETED
+            self.deleted += 1
+
+
+class BudgetTable(SheetCache):
+    """In-memory copy of the Budgets sheet, indexed by (user_id, category)."""
+
+    def __init__(self, max_age=300):
+        self.amounts = {}  # user id -> {category: amount}
+        self.budget_rows = {}  # (user id, category) -> 1-indexed row number
+        self.user_rows = {}  # user id -> first 1-indexed row number for that user
+        super().__init__(max_age)
+
+    def _reindex(self):
+        # The Budgets sheet holds one row per user and category, so a full rebuild is cheap
+        self.amounts = {}
+        self.budget_rows = {}
+        self.user_rows = {}
+        for row_number, row in enumerate(self.rows or [], start=1):
+            if row_number == 1 or not row:  # Skip header row
+                continue
+            user = str(row[0])
+            self.user_rows.setdefault(user, row_number)
+            if len(row) >= 2:
+                self.budget_rows.setdefault((user, row[1]), row_number)
+            if len(row) >= 3:
+                budgets = self.amounts.setdefault(user, {})
+                if row[1] not in budgets:
+                    try:
+                        budgets[row[1]] = float(row[2])
+                    except ValueError:
+                        pass
+
+    def get(self, user_id, category):
+        return self.amounts.get(str(user_id), {}).get(category)
+
+    def for_user(self, user_id):
+        """Return all of a user's budgets as {category: amount}."""
+        return dict(self.amounts.get(str(user_id), {}))
+
+    def set_cell(self, row_number, column, value):
+        """Mirror a single-cell update at a 1-indexed row and 0-indexed column."""
+        if self.rows is None:
+            return
+        if not 1 < row_number <= len(self.rows):
+            self.invalidate()
+            return
+        row = self.rows[row_number - 1]
+        while len(row) <= column:
+            row.append('')
+        row[column] = value
+        self._reindex()
+
+    def append_row(self, start_row, row):
+        """Record a row the sheet appended at start_row (1-indexed)."""
+        if self.rows is None:
+            return
+        if start_row is None or start_row != len(self.rows) + 1:
+            self.invalidate()
+            return
+        self.rows.append(list(row))
+        self._reindex()
+
+
+class DailyTotalsTable(SheetCache):
+    """In-memory copy of the DailyTotals rollup, one row per (user_id, date, category key)."""
+
+    def __init__(self, max_age=300):
+        self.row_numbers = {}  # (user id, date ordinal, category) -> 1-indexed row number
+        self.days = {}  # user id -> sorted date ordinals that have totals
+        self.totals = {}  # user id -> {date ordinal: {category: amount}}
+        super().__init__(max_age)
+
+    def _reindex(self):
+        self.row_numbers = {}
+        self.days = {}
+        self.totals = {}
+        for row_number, row in enumerate(self.rows or [], start=1):
+            if row_number > 1:  # Skip header row
+                self._index_row(row_number, row)
+
+    def _index_row(self, row_number, row):
+        if len(row) < 4:
+            return
+        try:
+            ordinal = date_ordinal(row[1])
+            amount = float(row[3])
+        except (TypeError, ValueError):
+            return
+        user = str(row[0])
+        self.row_numbers[(user, ordinal, row[2])] = row_number
+        days = self.totals.setdefault(user, {})
+        if ordinal not in days:
+            insort(self.days.setdefault(user, []), ordinal)
+            days[ordinal] = {}
+        days[ordinal][row[2]] = days[ordinal].get(row[2], 0) + amount
+
+    def amount(self, row_number):
+        """Return the amount stored in a 1-indexed row."""
+        return float(self.rows[row_number - 1][3])
+
+    def set_amount(self, row_number, amount):
+        """Mirror an update of the Amount cell in a 1-indexed row."""
+        if self.rows is None:
+            return
+        if not 1 < row_number <= len(self.rows):
+            self.invalidate()
+            return
+        row = self.rows[row_number - 1]
+        change = amount - float(row[3])
+        row[3] = amount
+        category_totals = self.totals[str(row[0])][date_ordinal(row[1])]
+        category_totals[row[2]] += change
+
+    def append_rows(self, start_row, rows):
+        """Record rows the sheet appended at start_row (1-indexed)."""
+        if self.rows is None:
+            return
+        if start_row is None or start_row != len(self.rows) + 1:
+            self.invalidate()
+            return
+        for row in rows:
+            row = list(row)
+            self.rows.append(row)
+            self._index_row(len(self.rows), row)
+
+    def summarize(self, user_id, start_date=None, end_date=None):
+        """Return a user's {category: total} for dates between start_date and end_date inclusive."""
+        user = str(user_id)
+        days = self.days.get(user, [])
+        lo = bisect_left(days, start_date.toordinal()) if start_date else 0
+        hi = bisect_right(days, end_date.toordinal()) if end_date else len(days)
+        summary = {}
+        for ordinal in days[lo:hi]:
+            for category, amount in self.totals[user][ordinal].items():
+                summary[category] = summary.get(category, 0) + amount
+        # Days whose expenses were all deleted keep a zero row until the next rebuild
+        return {category: total for category, total in summary.items() if abs(total) >= 0.005}
@@ -0,0 +1,231 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from cache hits up to Sheets calls that needed retries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Every metric created below, in the order they are rendered
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric:
+    """A metric family with one series per combination of label values.
+
+    Updates take a short lock and touch one dict entry, so instrumenting hot
+    paths costs well under a microsecond per call.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._series = {}  # label values -> value
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _label_text(self, label_values, extra=()):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+    def _samples(self, label_values, value):
+        return [f'{self.name}{self._label_text(label_values)} {value}']
+
+    def render(self):
+        """Return this family's lines in the Prometheus text exposition format."""
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for label_values, value in self._snapshot():
+            lines.extend(self._samples(label_values, value))
+        return lines
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that is set to its latest reading."""
+
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._series[label_values] = value
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket (not cumulative) counts, then the sum of observations
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe how long the enclosed block takes, whether or not it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted((label_values, (list(counts), total)) for label_values, (counts, total) in self._series.items())
+
+    def _samples(self, label_values, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{self._label_text(label_values, [("le", bound)])} {cumulative}')
+        lines.append(f'{self.name}_sum{self._label_text(label_values)} {total}')
+        lines.append(f'{self.name}_count{self._label_text(label_values)} {cumulative}')
+        return lines
+
+
+def render():
+    """Return every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+SHEETS_API_SECONDS = Histogram(
+    'sheets_api_request_seconds', 'Time for one Sheets API round trip, by API method', ('method',))
+SHEETS_API_ERRORS = Counter(
+    'sheets_api_errors_total', 'Sheets API round trips that failed, by API method and HTTP status', ('method', 'status'))
+LEDGER_CACHE_LOOKUPS = Counter(
+    'ledger_cache_lookups_total',
+    'Expense tab reads by outcome: hit (cache fresh), tail (only new rows read), full or resync (whole tab read)',
+    ('result',))
+STORAGE_CALL_SECONDS = Histogram(
+    'storage_call_seconds', 'Time for storage backend calls made by the bot, including waiting for a worker', ('method',))
+HANDLER_SECONDS = Histogram(
+    'telegram_handler_seconds', 'Time spent in each Telegram command and callback handler', ('handler',))
+HANDLER_SHEETS_CALLS = Counter(
+    'telegram_handler_sheets_calls_total', 'Sheets API round trips made on behalf of each Telegram handler', ('handler',))
+HANDLER_ERRORS = Counter(
+    'telegram_handler_errors_total', 'Telegram handlers that raised an exception', ('handler',))
+JOB_SECONDS = Histogram(
+    'job_seconds', 'Run time of scheduled jobs', ('job',))
+DAILY_SUMMARY_USERS = Gauge(
+    'daily_summary_users', 'Users sent a summary by the last daily summary run')
+DAILY_SUMMARY_ERRORS = Counter(
+    'daily_summary_errors_total', 'Daily summaries that failed to send')
+
+
+# (API method, seconds) for each Sheets call made on behalf of the current handler, or None
+# outside handlers. Worker threads see the same list because AsyncSheetsManager runs each
+# call inside a copy of the caller's context.
+current_sheets_calls = contextvars.ContextVar('current_sheets_calls', default=None)
+
+
+@contextmanager
+def sheets_call(method):
+    """Time one Sheets API round trip and attribute it to the handler that caused it."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SHEETS_API_SECONDS.observe(elapsed, method)
+        calls = current_sheets_calls.get()
+        if calls is not None:
+            calls.append((method, elapsed))
+
+
+class RecentHandlers:
+    """The last few hundred handler invocations, for finding the slow ones."""
+
+    def __init__(self, size=500):
+        self._entries = deque(maxlen=size)
+
+    def record(self, handler, user_id, command, seconds, sheets_calls, error):
+        self._entries.append({
+            'handler': handler,
+            'user_id': user_id,
+            'command': command,
+            'seconds': round(seconds, 4),
+            'error': error,
+            'sheets_calls': [{'method': method, 'seconds': round(elapsed, 4)} for method, elapsed in sheets_calls],
+        })
+
+    def slowest(self, limit=20):
+        return sorted(list(self._entries), key=lambda entry: entry['seconds'], reverse=True)[:limit]
+
+
+RECENT_HANDLERS = RecentHandlers()
+
+
+def _describe_update(update):
+    """Return (user id, command text or callback data) for a Telegram update, if it is one."""
+    user = getattr(update, 'effective_user', None)
+    message = getattr(update, 'message', None)
+    query = getattr(update, 'callback_query', None)
+    command = (message.text if message else None) or (query.data if query else None) or ''
+    return (user.id if user else None), command[:100]
+
+
+def timed_handler(handler):
+    """Decorate an async Telegram handler to record its duration, the Sheets calls it made and any exception it raises."""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        calls = []
+        token = current_sheets_calls.set(calls)
+        start = time.perf_counter()
+        error = None
+        try:
+            return await handler(*args, **kwargs)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name)
+            error = repr(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            current_sheets_calls.reset(token)
+            HANDLER_SECONDS.observe(elapsed, name)
+            # Divided by telegram_handler_seconds_count, the Sheets calls each command costs
+            HANDLER_SHEETS_CALLS.inc(name, amount=len(calls))
+            user_id, command = _describe_update(args[0]) if args else (None, '')
+            RECENT_HANDLERS.record(name, user_id, command, elapsed, calls, error)
+
+    return wrapper
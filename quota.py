@@ -0,0 +1,98 @@
+import contextvars
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Priority lanes; lower numbers go first
+INTERACTIVE = 0
+BULK = 1
+
+# Lane for Sheets calls made in the current context. Worker threads inherit it because
+# AsyncSheetsManager runs each call inside a copy of the caller's context.
+current_priority = contextvars.ContextVar('sheets_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def priority(lane):
+    """Run the enclosed Sheets calls in the given lane."""
+    token = current_priority.set(lane)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def bulk_priority():
+    """Run the enclosed Sheets calls in the bulk lane, behind interactive commands."""
+    return priority(BULK)
+
+
+def request_kind(method_id):
+    """Classify an API method as a 'read' or 'write' for quota purposes."""
+    return 'read' if method_id.endswith(('.get', '.batchGet')) else 'write'
+
+
+class TokenBucket:
+    """Refills at per_minute tokens per minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, tokens):
+        """Return how long until the bucket holds the given number of tokens."""
+        return max(0, (tokens - self.tokens) / self.rate)
+
+
+class QuotaScheduler:
+    """Paces Sheets API calls to the per-minute read and write quotas.
+
+    Each call takes a token from its bucket. Callers in the bulk lane wait while
+    an interactive caller is waiting for the same bucket, and may not dip into
+    the last bulk_reserve fraction of it, so background jobs can't use up the
+    quota live users need (unless the limit is too small to leave one). A limit
+    of 0 disables pacing for that bucket.
+    """
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, bulk_reserve=0.25):
+        self.buckets = {
+            kind: TokenBucket(per_minute)
+            for kind, per_minute in (('read', reads_per_minute), ('write', writes_per_minute)) if per_minute > 0
+        }
+        self.bulk_reserve = bulk_reserve
+        self._condition = threading.Condition()
+        self._waiting = Counter()  # (kind, priority) -> callers waiting for a token
+
+    def acquire(self, kind, priority=None):
+        """Block until a call of the given kind may be made in the caller's priority lane."""
+        bucket = self.buckets.get(kind)
+        if bucket is None:
+            return
+        if priority is None:
+            priority = current_priority.get()
+        needed = 1 + (bucket.capacity * self.bulk_reserve if priority > INTERACTIVE else 0)
+        # A full bucket never holds more than capacity, so with a tiny limit bulk callers get no reserve
+        needed = min(needed, bucket.capacity)
+
+        with self._condition:
+            self._waiting[(kind, priority)] += 1
+            try:
+                while True:
+                    bucket.refill()
+                    ahead = any(self._waiting[(kind, lane)] for lane in range(priority))
+                    if not ahead and bucket.tokens >= needed:
+                        bucket.tokens -= 1
+                        return
+                    # A higher lane finishing wakes us via notify_all; otherwise wait for the refill
+                    self._condition.wait(None if ahead else bucket.seconds_until(needed))
+            finally:
+                self._waiting[(kind, priority)] -= 1
+                self._condition.notify_all()
@@ -0,0 +1,352 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from constants import CATEGORY_KEYS
+from storage import Expense, ExpenseStore, LatestExpense
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    amount REAL NOT NULL,
+    category TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses (user_id, date);
+CREATE INDEX IF NOT EXISTS idx_expenses_user_category ON expenses (user_id, category);
+
+CREATE TABLE IF NOT EXISTS budgets (
+    user_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (user_id, category)
+);
+
+CREATE TABLE IF NOT EXISTS chats (
+    user_id TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL
+);
+"""
+
+
+class SQLiteExpenseStore(ExpenseStore):
+    """Local SQLite storage backend; summaries are SQL aggregates over indexed columns.
+
+    If sync_target is given (e.g. a GoogleSheetsManager), every write is replayed
+    to it in order on a background thread, so the local database stays the source
+    of truth and the sheet is a best-effort mirror.
+    """
+
+    def __init__(self, path='expenses.db', sync_target=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self._lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+
+        self.sync_target = sync_target
+        # A single worker keeps mirrored writes in the order they were made
+        self._sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-sync') if sync_target else None
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cursor
+
+    def _sync(self, method_name, *args):
+        """Replay a write on the sync target without waiting for it."""
+        if not self._sync_executor:
+            return
+
+        def run():
+            try:
+                getattr(self.sync_target, method_name)(*args)
+            except Exception as e:
+                print(f"Error syncing {method_name} to sync target: {e}")
+
+        self._sync_executor.submit(run)
+
+    def add_expense(self, user_id, date, amount, category, description=""):
+        """Add a new expense to the database."""
+        try:
+            self._write(
+                'INSERT INTO expenses (user_id, date, amount, category, description) VALUES (?, ?, ?, ?, ?)',
+                (str(user_id), date, float(amount), category, description or '')
+            )
+            self._sync('add_expense', user_id, date, amount, category, description)
+            return True
+        except Exception as e:
+            print(f"Error adding expense: {e}")
+            return False
+
+    def get_expenses(self, user_id, start_date=None, end_date=None):
+        """Get expenses for a user within a date range."""
+        try:
+            sql = 'SELECT date, amount, category, description FROM expenses WHERE user_id = ?'
+            params = [str(user_id)]
+            if start_date and end_date:
+                sql += ' AND date BETWEEN ? AND ?'
+                params += [start_date.isoformat(), end_date.isoformat()]
+            sql += ' ORDER BY date, id'
+            return [Expense(date.fromisoformat(row['date']), row['amount'], row['category'], row['description'])
+                    for row in self._query(sql, params)]
+        except Exception as e:
+            print(f"Error getting expenses: {e}")
+            return []
+
+    def _summarize(self, user_id, start_date=None, end_date=None):
+        """Sum a user's expenses per category key between two dates inclusive."""
+        sql = 'SELECT category, SUM(amount) AS total FROM expenses WHERE user_id = ?'
+        params = [str(user_id)]
+        if start_date:
+            sql += ' AND date >= ?'
+            params.append(start_date.isoformat())
+        if end_date:
+            sql += ' AND date <= ?'
+            params.append(end_date.isoformat())
+        sql += ' GROUP BY category'
+
+        summary = {}
+        for row in self._query(sql, params):
+            # Older rows may hold the display value instead of the key
+            category = CATEGORY_KEYS.get(row['category'], row['category'])
+            summary[category] = summary.get(category, 0) + row['total']
+        return summary
+
+    def get_daily_summary(self, user_id):
+        """Get summary of expenses for today."""
+        try:
+            today = datetime.now().date()
+            return self._summarize(user_id, today, today)
+        except Exception as e:
+            print(f"Error getting daily summary: {e}")
+            return {}
+
+    def get_weekly_summary(self, user_id):
+        """Get summary of expenses for the current week."""
+        try:
+            today = datetime.now().date()
+            return self._summarize(user_id, today - timedelta(days=today.weekday()), today)
+        except Exception as e:
+            print(f"Error getting weekly summary: {e}")
+            return {}
+
+    def get_monthly_summary(self, user_id):
+        """Get summary of expenses for the current month and the last 31 days."""
+        try:
+            today = datetime.now().date()
+            return {
+                "this_month": self._summarize(user_id, today.replace(day=1), today),
+                "last_31_days": self._summarize(user_id, today - timedelta(days=30), today)
+            }
+        except Exception as e:
+            print(f"Error getting monthly summary: {e}")
+            return {}
+
+    def get_last_month_summary(self, user_id):
+        """Get summary of expenses for the previous calendar month."""
+        try:
+            today = datetime.now().date()
+            last_day_of_last_month = today.replace(day=1) - timedelta(days=1)
+            return self._summarize(user_id, last_day_of_last_month.replace(day=1), last_day_of_last_month)
+        except Exception as e:
+            print(f"Error getting last month summary: {e}")
+            return {}
+
+    def get_yearly_summary(self, user_id):
+        """Get summary of expenses for the current year."""
+        try:
+            today = datetime.now().date()
+            return self._summarize(user_id, today.replace(month=1, day=1), today)
+        except Exception as e:
+            print(f"Error getting yearly summary: {e}")
+            return {}
+
+    def get_all_time_summary(self, user_id):
+        """Get summary of all time expenses."""
+        try:
+            return self._summarize(user_id)
+        except Exception as e:
+            print(f"Error getting all time summary: {e}")
+            return {}
+
+    def get_period_summaries(self, user_id):
+        """Get today's, this week's, this month's and the last 31 days' summaries plus budgets in one query."""
+        try:
+            today = datetime.now().date()
+            window_starts = {
+                'today': today,
+                'this_week': today - timedelta(days=today.weekday()),
+                'this_month': today.replace(day=1),
+                'last_31_days': today - timedelta(days=30),
+            }
+            columns = ', '.join(
+                f'SUM(CASE WHEN date >= ? THEN amount ELSE 0 END) AS {name}' for name in window_starts
+            )
+            rows = self._query(
+                f'SELECT category, {columns} FROM expenses '
+                'WHERE user_id = ? AND date BETWEEN ? AND ? GROUP BY category',
+                [start.isoformat() for start in window_starts.values()]
+                + [str(user_id), min(window_starts.values()).isoformat(), today.isoformat()]
+            )
+
+            summaries = {name: {} for name in window_starts}
+            for row in rows:
+                category = CATEGORY_KEYS.get(row['category'], row['category'])
+                for name in window_starts:
+                    if row[name]:
+                        summaries[name][category] = summaries[name].get(category, 0) + row[name]
+
+            summaries['budgets'] = self.get_budgets(user_id)
+            return summaries
+        except Exception as e:
+            print(f"Error getting period summaries: {e}")
+            return {}
+
+    def set_budget(self, user_id, category, amount):
+        """Set budget for a category."""
+        try:
+            self._write(
+                'INSERT INTO budgets (user_id, category, amount) VALUES (?, ?, ?) '
+                'ON CONFLICT (user_id, category) DO UPDATE SET amount = excluded.amount',
+                (str(user_id), category, float(amount))
+            )
+            self._sync('set_budget', user_id, category, amount)
+            return True
+        except Exception as e:
+            print(f"Error setting budget: {e}")
+            return False
+
+    def get_budget(self, user_id, category):
+        """Get budget for a category."""
+        try:
+            rows = self._query(
+                'SELECT amount FROM budgets WHERE user_id = ? AND category = ?', (str(user_id), category)
+            )
+            return rows[0]['amount'] if rows else None
+        except Exception as e:
+            print(f"Error getting budget: {e}")
+            return None
+
+    def get_budgets(self, user_id):
+        """Get all of a user's budgets as a {category: amount} dict."""
+        try:
+            rows = self._query('SELECT category, amount FROM budgets WHERE user_id = ?', (str(user_id),))
+            return {row['category']: row['amount'] for row in rows}
+        except Exception as e:
+            print(f"Error getting budgets: {e}")
+            return {}
+
+    def save_user_chat_id(self, user_id, chat_id):
+        """Save or update a user's chat ID."""
+        try:
+            self._write(
+                'INSERT INTO chats (user_id, chat_id) VALUES (?, ?) '
+                'ON CONFLICT (user_id) DO UPDATE SET chat_id = excluded.chat_id',
+                (str(user_id), str(chat_id))
+            )
+            self._sync('save_user_chat_id', user_id, chat_id)
+            return True
+        except Exception as e:
+            print(f"Error saving user chat ID: {e}")
+            return False
+
+    def get_all_users_with_chat_id(self):
+        """Retrieves all user IDs and their associated Chat IDs."""
+        try:
+            return [dict(row) for row in self._query('SELECT user_id, chat_id FROM chats')]
+        except Exception as e:
+            print(f"Error getting all users with chat ID: {e}")
+            return []
+
+    def delete_expenses_today(self, user_id, category=None):
+        """Deletes expense entries for a user for today, optionally filtered by category."""
+        try:
+            sql = 'DELETE FROM expenses WHERE user_id = ? AND date = ?'
+            params = [str(user_id), datetime.now().strftime("%Y-%m-%d")]
+            if category is not None:
+                sql += ' AND lower(category) = lower(?)'
+                params.append(category)
+            deleted = self._write(sql, params).rowcount
+            if not deleted:
+                print(f"No matching expenses found for deletion for user {user_id} today (category: {category}).")
+                return False
+
+            self._sync('delete_expenses_today', user_id, category)
+            print(f"Deleted {deleted} expenses for user {user_id} for today (category: {category}).")
+            return True
+        except Exception as e:
+            print(f"Error deleting expenses: {e}")
+            return False
+
+    def get_latest_expense(self, user_id):
+        """Gets the latest expense entry for a user; row_index is the expense's row id."""
+        try:
+            rows = self._query(
+                'SELECT id AS row_index, date, amount, category, description FROM expenses '
+                'WHERE user_id = ? ORDER BY id DESC LIMIT 1',
+                (str(user_id),)
+            )
+            if not rows:
+                return None
+            row = rows[0]
+            return LatestExpense(date.fromisoformat(row['date']), row['amount'], row['category'], row['description'],
+                                 row['row_index'], None)
+        except Exception as e:
+            print(f"Error getting latest expense: {e}")
+            return None
+
+    def delete_row(self, row_index, sheet_name=None, user_id=None, expected=None):
+        """Deletes the expense with the given row id; sheet_name is unused here."""
+        try:
+            rows = self._query('SELECT * FROM expenses WHERE id = ?', (row_index,))
+            if not rows:
+                print(f"Invalid row index for deletion: {row_index}")
+                return False
+            row = rows[0]
+            if ((user_id is not None and row['user_id'] != str(user_id)) or
+                    (expected is not None and (row['date'] != expected.date.isoformat()
+                                               or row['category'] != expected.category
+                                               or abs(row['amount'] - expected.amount) >= 0.005))):
+                print(f"Row {row_index} does not hold the expense to delete; leaving it.")
+                return False
+            self._write('DELETE FROM expenses WHERE id = ?', (row_index,))
+            if self._sync_executor:
+                self._sync_executor.submit(self._sync_delete, dict(rows[0]))
+            print(f"Deleted row {row_index}.")
+            return True
+        except Exception as e:
+            print(f"Error deleting row {row_index}: {e}")
+            return False
+
+    def compact_expenses(self):
+        """Rows are deleted immediately here, so only the sync target needs compacting."""
+        self._sync('compact_expenses')
+        return True
+
+    def rebuild_daily_totals(self):
+        """Summaries are SQL aggregates here, so only the sync target keeps a rollup."""
+        self._sync('rebuild_daily_totals')
+        return True
+
+    def _sync_delete(self, expense):
+        """Mirror an undo: delete the sync target's latest expense for the user if it is the same one."""
+        try:
+            latest = self.sync_target.get_latest_expense(expense['user_id'])
+            if (latest and latest.date.isoformat() == expense['date'] and latest.category == expense['category']
+                    and abs(latest.amount - expense['amount']) < 0.005):
+                self.sync_target.delete_row(latest.row_index, latest.sheet, expense['user_id'], latest)
+            else:
+                print(f"Sync target has no matching latest expense for user {expense['user_id']}; skipped delete.")
+        except Exception as e:
+            print(f"Error syncing delete to sync target: {e}")
@@ -0,0 +1,170 @@
+import csv
+import os
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import Future
+
+# One expense; date is a datetime.date and amount a float. Tuples carry no per-instance
+# __dict__, so a long history costs far less than the same expenses as dicts.
+Expense = namedtuple('Expense', ['date', 'amount', 'category', 'description'])
+
+# An expense from get_latest_expense, with the row_index and sheet that delete_row needs
+LatestExpense = namedtuple('LatestExpense', Expense._fields + ('row_index', 'sheet'))
+
+
+class ExpenseStore(ABC):
+    """Storage operations the bot relies on.
+
+    Expenses are Expense records, category summaries are {category_key: total}
+    dicts and budgets are {category: amount} dicts, whichever backend produces them.
+    """
+
+    @abstractmethod
+    def add_expense(self, user_id, date, amount, category, description=""):
+        """Add a new expense. Returns True on success."""
+
+    def queue_expense(self, user_id, date, amount, category, description=""):
+        """Add an expense and return a Future that resolves to True on success.
+
+        Backends that batch their writes override this; the default writes immediately.
+        """
+        future = Future()
+        future.set_result(self.add_expense(user_id, date, amount, category, description))
+        return future
+
+    @abstractmethod
+    def get_expenses(self, user_id, start_date=None, end_date=None):
+        """Get a user's expenses as a list of Expense records, optionally limited to start_date..end_date inclusive."""
+
+    def iter_expenses(self, user_id, start_date=None, end_date=None):
+        """Yield a user's expenses like get_expenses, for scans over their whole history.
+
+        Backends that can read in pieces override this to keep memory bounded.
+        """
+        yield from self.get_expenses(user_id, start_date, end_date)
+
+    def export_expenses_csv(self, user_id, path):
+        """Write all of a user's expenses to a CSV file. Returns the number written, or None on failure."""
+        try:
+            count = 0
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['Date', 'Amount', 'Category', 'Description'])
+                for expense in self.iter_expenses(user_id):
+                    writer.writerow([expense.date.isoformat(), expense.amount, expense.category, expense.description])
+                    count += 1
+            return count
+        except Exception as e:
+            print(f"Error exporting expenses: {e}")
+            return None
+
+    @abstractmethod
+    def get_daily_summary(self, user_id):
+        """Get summary of expenses for today."""
+
+    @abstractmethod
+    def get_weekly_summary(self, user_id):
+        """Get summary of expenses for the current week."""
+
+    @abstractmethod
+    def get_monthly_summary(self, user_id):
+        """Get {'this_month': summary, 'last_31_days': summary}."""
+
+    @abstractmethod
+    def get_last_month_summary(self, user_id):
+        """Get summary of expenses for the previous calendar month."""
+
+    @abstractmethod
+    def get_yearly_summary(self, user_id):
+        """Get summary of expenses for the current year."""
+
+    @abstractmethod
+    def get_all_time_summary(self, user_id):
+        """Get summary of all time expenses."""
+
+    @abstractmethod
+    def get_period_summaries(self, user_id):
+        """Get 'today', 'this_week', 'this_month' and 'last_31_days' summaries plus 'budgets'."""
+
+    @abstractmethod
+    def set_budget(self, user_id, category, amount):
+        """Set budget for a category. Returns True on success."""
+
+    @abstractmethod
+    def get_budget(self, user_id, category):
+        """Get budget for a category, or None if none is set."""
+
+    @abstractmethod
+    def get_budgets(self, user_id):
+        """Get all of a user's budgets."""
+
+    @abstractmethod
+    def save_user_chat_id(self, user_id, chat_id):
+        """Save or update a user's chat ID. Returns True on success."""
+
+    @abstractmethod
+    def get_all_users_with_chat_id(self):
+        """Get a list of {'user_id': ..., 'chat_id': ...} dicts."""
+
+    @abstractmethod
+    def delete_expenses_today(self, user_id, category=None):
+        """Delete today's expenses for a user, optionally only one category. Returns True if any were deleted."""
+
+    @abstractmethod
+    def get_latest_expense(self, user_id):
+        """Get the user's most recently added expense as a LatestExpense, or None."""
+
+    @abstractmethod
+    def delete_row(self, row_index, sheet_name=None, user_id=None, expected=None):
+        """Delete the expense identified by the row_index and sheet from get_latest_expense. Returns True on success.
+
+        If user_id and expected (the Expense that was read) are given, nothing is
+        deleted unless the row still holds that user's expense.
+        """
+
+    def compact_expenses(self):
+        """Physically remove soft-deleted expenses. Returns True on success.
+
+        Backends that delete immediately have nothing to compact.
+        """
+        return True
+
+    def save_snapshot(self):
+        """Save cached data to local disk for a faster next start. Returns True if a snapshot was written.
+
+        Backends that already keep their data locally have nothing to save.
+        """
+        return False
+
+    def cache_stats(self):
+        """Describe any in-process caches for the admin memory report.
+
+        Backends without in-process caches have nothing to report.
+        """
+        return {}
+
+    def rebuild_daily_totals(self):
+        """Regenerate any per-day rollup from the raw expenses. Returns True on success.
+
+        Backends that aggregate on every read have no rollup to rebuild.
+        """
+        return True
+
+
+def create_store():
+    """Build the storage backend selected by the STORAGE_BACKEND environment variable."""
+    backend = os.getenv('STORAGE_BACKEND', 'sheets').lower()
+
+    if backend == 'sheets':
+        from google_sheets import GoogleSheetsManager
+        return GoogleSheetsManager()
+
+    if backend == 'sqlite':
+        from sqlite_store import SQLiteExpenseStore
+        sync_target = None
+        if os.getenv('SQLITE_SYNC_TO_SHEETS', '').lower() in ('1', 'true', 'yes'):
+            from google_sheets import GoogleSheetsManager
+            sync_target = GoogleSheetsManager()
+        return SQLiteExpenseStore(os.getenv('SQLITE_PATH', 'expenses.db'), sync_target=sync_target)
+
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")